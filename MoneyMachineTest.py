@@ -0,0 +1,514 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+import requests
+from pandas.testing import assert_frame_equal, assert_series_equal
+
+import backtest as bt
+import macro_data as macro
+import market_data as md
+import money_machine as mm
+
+# multpl.com by-month pages under fixtures/multpl. Made-up numbers in multpl's table layout until
+# they're re-recorded from the site with: python macro_data.py
+fixture_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture_fetch(url):
+    """ Serve multpl urls from fixtures/multpl/<page>.html """
+    page = url.split('/')[3]
+    with open(os.path.join(fixture_dir, 'multpl', page + '.html')) as f:
+        return f.read()
+
+def shiller_frame(start='1999-01', end='2023-06'):
+    """ Made-up frame laid out like get_data_from_shiller: str of Shiller's float dates as the index """
+
+    months = pd.period_range(start, end, freq='M')
+    n = len(months)
+    df = pd.DataFrame({'s&p comp price': np.linspace(1200., 4400., n),
+                       's&p comp div': np.linspace(15., 65., n),
+                       's&p comp earnings': np.linspace(50., 190., n),
+                       'CPI': np.linspace(165., 305., n),
+                       'date fraction': months.year + (months.month - .5) / 12,
+                       'int rate GS10': np.linspace(6., 3.5, n),
+                       'real price': np.linspace(2200., 4500., n),
+                       'real div': np.linspace(28., 66., n),
+                       'real total ret price': np.linspace(300., 2900., n),
+                       'real earnings': np.linspace(90., 195., n),
+                       'real tr scaled earnings': np.linspace(20., 130., n),
+                       'CAPE': np.linspace(40., 30., n)})
+    df.index = pd.Index((months.year + months.month / 100).astype(str), name='date')
+    return df
+
+def shiller_workbook(df):
+    """ xlsx bytes laid out like ie_data.xls: 8 rows of headings, data from row 9, a footer note """
+
+    block = df.reset_index()
+    block['date'] = block['date'].astype(float)
+    block.loc[len(block)] = ['Note: made-up footer'] + [None] * (block.shape[1] - 1)
+
+    out = io.BytesIO()
+    with pd.ExcelWriter(out) as writer:
+        block.to_excel(writer, sheet_name='Data', startrow=8, header=False, index=False)
+    return out.getvalue()
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class MultplTests(unittest.TestCase):
+
+    """ multpl loader against saved pages """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetched = []
+
+        def fetch(url):
+            self.fetched.append(url)
+            return fixture_fetch(url)
+
+        self.loader = macro.MultplLoader(cache_dir=self.cache_dir, fetch=fetch)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_parse_drops_estimate_row(self):
+        """ Percent pages come back as fractions and the current month's estimate is dropped """
+
+        s = macro.parse_multpl_table(fixture_fetch(macro.multpl_url.format(path='s-p-500-dividend-yield')), 'DivYield', .01)
+
+        self.assertEqual(s.index[0], pd.Timestamp('2023-07-01'))
+        self.assertTrue(((s > 0) & (s < .1)).all())
+
+    def test_trim_page(self):
+        """ A trimmed page parses to the same months & numbers, from the cut-off on """
+
+        page = fixture_fetch(macro.multpl_url.format(path='s-p-500-pe-ratio'))
+        full = macro.parse_multpl_table(page, 'PE')
+        trimmed = macro.parse_multpl_table(macro.trim_multpl_page(page, '2022-01-01'), 'PE')
+
+        self.assertEqual(trimmed.index[-1], pd.Timestamp('2022-01-01'))
+        assert_series_equal(trimmed, full[full.index >= '2022-01-01'])
+
+    def test_multpl_site_frame(self):
+        """ Same layout as before: PE, DivYield, TsyYield by 'M-YYYY' """
+
+        df = mm.get_data_from_multpl_site(loader=self.loader)
+
+        self.assertEqual(list(df.columns), ['PE', 'DivYield', 'TsyYield'])
+        self.assertIn('3-2000', df.index)
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_cache_and_offline(self):
+        """ Second load comes from the cache; offline works from the cache alone """
+
+        self.loader.load(['PE', 'CAPE_multpl'])
+        self.loader.load(['PE', 'CAPE_multpl'])
+        self.assertEqual(len(self.fetched), 2)
+
+        offline = macro.MultplLoader(cache_dir=self.cache_dir, offline=True, fetch=None)
+        self.assertEqual(set(offline.load(['PE', 'CAPE_multpl'])), {'PE', 'CAPE_multpl'})
+        self.assertRaises(ValueError, offline.load, ['TsyYield'])
+
+
+class MacroFrameTests(unittest.TestCase):
+
+    """ multpl & Shiller lined up on one monthly PeriodIndex """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        loader = macro.MultplLoader(cache_dir=self.cache_dir, fetch=fixture_fetch)
+        self.shiller = shiller_frame()
+        self.tbl = mm.get_macro_dataset(loader=loader, shiller_df=self.shiller)
+        self.multpl = mm.get_data_from_multpl_site(loader=loader)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_months_align(self):
+        """ Every month present once; Shiller's '2016.1' is October, not January """
+
+        self.assertIsInstance(self.tbl.index, pd.PeriodIndex)
+        self.assertTrue(self.tbl.index.is_monotonic_increasing)
+        self.assertEqual(len(self.tbl), self.tbl.index[-1].ordinal - self.tbl.index[0].ordinal + 1)
+        self.assertEqual(self.tbl.loc[pd.Period('2016-10', 'M'), 'CAPE'], self.shiller.loc['2016.1', 'CAPE'])
+        self.assertEqual(self.tbl.loc['2000-03', 'PE'], self.multpl.loc['3-2000', 'PE'])
+
+    def test_store_appends_new_months(self):
+        """ The store gives the same frame; a later update only appends the months a source added """
+
+        store = macro.MacroStore(os.path.join(self.cache_dir, 'macro'))
+        loader = macro.MultplLoader(cache_dir=self.cache_dir, fetch=fixture_fetch)
+
+        # Shiller a few months behind at first
+        early = mm.get_macro_dataset(loader=loader, shiller_df=self.shiller.iloc[:-3], store=store)
+        self.assertTrue(early.loc['2023-04':, 'CAPE'].isna().all())
+
+        added = store.update(shiller=self.shiller)
+        self.assertEqual(list(added['shiller'].astype(str)), ['2023-04', '2023-05', '2023-06'])
+        self.assertEqual(len(store.update(shiller=self.shiller)['shiller']), 0)
+
+        tbl, provenance, stored = store.load(provenance=True)
+        assert_frame_equal(tbl, self.tbl, check_like=True)
+        self.assertTrue(stored.loc['2023-07', 'CAPE'] is pd.NaT)
+        self.assertTrue(stored.loc['2023-07', 'PE'] is not pd.NaT)
+        self.assertEqual(provenance.loc['2023-07', 'PE'], 'multpl')
+        self.assertEqual(provenance.loc['2023-06', 'CAPE'], 'shiller')
+        self.assertIsNone(provenance.loc['2023-07', 'CAPE'])
+
+    def test_store_fills_lagging_series(self):
+        """ A series a month behind its siblings is filled in when it catches up; a revision replaces the old number """
+
+        store = macro.MacroStore(os.path.join(self.cache_dir, 'macro'))
+        loader = macro.MultplLoader(cache_dir=self.cache_dir, fetch=fixture_fetch)
+        series = loader.load(['PE', 'DivYield', 'TsyYield'])
+
+        lagging = dict(series, DivYield=series['DivYield'].iloc[1:])
+        store.update(multpl=lagging, shiller=self.shiller)
+        tbl, provenance, stored = store.load(provenance=True)
+        self.assertTrue(np.isnan(tbl.loc['2023-07', 'DivYield']))
+        self.assertTrue(stored.loc['2023-07', 'DivYield'] is pd.NaT)
+        self.assertFalse(np.isnan(tbl.loc['2023-07', 'PE']))
+
+        added = store.update(multpl=series)
+        self.assertEqual(list(added['multpl'].astype(str)), ['2023-07'])
+        tbl, provenance, stored = store.load(provenance=True)
+        self.assertEqual(tbl.loc['2023-07', 'DivYield'], series['DivYield'].iloc[0])
+        self.assertTrue(stored.loc['2023-07', 'DivYield'] is not pd.NaT)
+        self.assertEqual(provenance.loc['2023-07', 'DivYield'], 'multpl')
+
+        # Shiller revises his preliminary last month
+        revised = self.shiller.copy()
+        revised.loc['2023.06', 'CAPE'] += 1
+        self.assertEqual(list(store.update(shiller=revised)['shiller'].astype(str)), ['2023-06'])
+        assert_frame_equal(store.load(), macro.build_macro_frame(series, revised), check_like=True)
+
+    def test_store_both_cape_series(self):
+        """ multpl's Shiller PE and Shiller's own CAPE are separate columns, each from its own source """
+
+        store = macro.MacroStore(os.path.join(self.cache_dir, 'macro'))
+        loader = macro.MultplLoader(cache_dir=self.cache_dir, fetch=fixture_fetch)
+        series = ('PE', 'CAPE_multpl')
+
+        tbl = mm.get_macro_dataset(series, loader=loader, shiller_df=self.shiller, store=store)
+        self.assertEqual(list(tbl.columns).count('CAPE'), 1)
+        assert_frame_equal(tbl, mm.get_macro_dataset(series, loader=loader, shiller_df=self.shiller), check_like=True)
+
+        # Updating again is a no-op: neither source overwrites the other's column
+        self.assertEqual({k: len(v) for k, v in store.update(loader.load(series), self.shiller).items()},
+                         {'multpl': 0, 'shiller': 0})
+
+        _, provenance, _ = store.load(provenance=True)
+        self.assertEqual(provenance.loc['2023-06', 'CAPE_multpl'], 'multpl')
+        self.assertEqual(provenance.loc['2023-06', 'CAPE'], 'shiller')
+
+    def test_calcs_match_string_tables(self):
+        """ A single month gives the same numbers as the old string-indexed lookups """
+
+        assert_frame_equal(mm.calcJBWSP500(self.tbl, 3, 2000).reset_index(drop=True),
+                           mm.calcJBWSP500(self.multpl, 3, 2000))
+        assert_frame_equal(mm.calcBogle(self.tbl, '2000-03').drop(columns='Month'),
+                           mm.calcBogle(self.multpl, 3, 2000))
+        assert_frame_equal(mm.calcShillerCAEP(self.tbl, pd.Timestamp('2016-10-15')).reset_index(drop=True),
+                           mm.calcShillerCAEP(self.shiller, 10, 2016))
+
+    def test_ranges(self):
+        """ A range of months gives a row (or a block of scenarios) per month """
+
+        jbw = mm.calcJBWSP500(self.tbl, ('2007-01', '2009-04'))
+        self.assertEqual(len(jbw), 28)
+        self.assertEqual(jbw.index[0], pd.Period('2007-01', 'M'))
+
+        self.assertEqual(len(mm.calcBogle(self.tbl, slice('2008-01', '2008-12'))), 12 * 5)
+        self.assertEqual(len(mm.calcShillerCAEP(self.tbl, slice('2020-01', '2023-06'))), 42)
+
+    def test_history_matches_single_months(self):
+        """ The whole-history versions agree with the per-month calcs """
+
+        assert_frame_equal(mm.calcJBWSP500History(self.tbl, '2007-01', '2009-04'),
+                           mm.calcJBWSP500(self.tbl, ('2007-01', '2009-04')))
+        assert_frame_equal(mm.calcBogleHistory(self.tbl, '2008-01', '2008-12'),
+                           mm.calcBogle(self.tbl, ('2008-01', '2008-12')), check_dtype=False)
+        assert_frame_equal(mm.calcShillerCAEPHistory(self.tbl, end='2023-06'),
+                           mm.calcShillerCAEP(self.tbl, (None, '2023-06')))
+
+
+class ShillerCacheTests(unittest.TestCase):
+
+    """ ie_data workbook cache: typed parse, conditional GETs, parquet snapshot """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.workbook = shiller_workbook(shiller_frame('2015-01', '2017-12'))
+        self.requests = []
+
+        def fetch(url, headers):
+            self.requests.append(headers)
+            if headers.get('If-None-Match') == '"v1"':
+                return FakeResponse(304)
+            return FakeResponse(200, self.workbook, {'ETag': '"v1"', 'Last-Modified': 'Mon, 07 Aug 2023 00:00:00 GMT'})
+
+        self.loader = macro.ShillerLoader(cache_dir=self.cache_dir, fetch=fetch)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_parse(self):
+        """ Datetime index, float columns, footer dropped, 2016.1 read as October """
+
+        df = self.loader.load()
+
+        self.assertIsInstance(df.index, pd.DatetimeIndex)
+        self.assertTrue((df.dtypes == float).all())
+        self.assertEqual(len(df), 36)
+        self.assertEqual(df.index[-1], pd.Timestamp('2017-12-01'))
+        self.assertIn(pd.Timestamp('2016-10-01'), df.index)
+        self.assertEqual(mm.calcShillerCAEP(df, 10, 2016).shape, (1, 5))
+
+    def test_conditional_get(self):
+        """ Within ttl the snapshot is used; after it the server is asked with the saved validators """
+
+        first = self.loader.load()
+        self.loader.load()
+        self.assertEqual(len(self.requests), 1)
+
+        self.loader.ttl = -1
+        assert_frame_equal(self.loader.load(), first)
+        self.assertEqual(self.requests[-1]['If-None-Match'], '"v1"')
+        self.assertEqual(len(self.requests), 2)
+
+        offline = macro.ShillerLoader(cache_dir=self.cache_dir, offline=True, fetch=None)
+        assert_frame_equal(offline.load(), first)
+        self.assertRaises(ValueError, macro.ShillerLoader(cache_dir=os.path.join(self.cache_dir, 'empty'), offline=True).load)
+
+
+class IRRTests(unittest.TestCase):
+
+    """ Batch IRR solver against npf.irr """
+
+    def test_irr_batch(self):
+        rng = np.random.default_rng(0)
+        cashflows = np.c_[-rng.uniform(50, 150, 50), rng.uniform(1, 10, (50, 30))]
+
+        np.testing.assert_allclose(mm.irr_batch(cashflows), [npf.irr(cf) for cf in cashflows], atol=1e-10)
+
+    def test_two_stage_matches_calcIRRforTikr(self):
+        """ The closed form agrees with the 100-year cashflow version, q == 1 cases included """
+
+        class Tikr(object):
+            info = {'dividendRate': .96, 'currentPrice': 180.}
+
+        grid = mm.calcIRRGrid(Tikr, [-.02, 0, .1], [0, 10, 100], [0, .05])
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [mm.calcIRRforTikr(Tikr, r1, n, r2) for r1 in [-.02, 0, .1] for n in [0, 10, 100] for r2 in [0, .05]]
+
+        self.assertEqual(len(grid), 18)
+        np.testing.assert_allclose(grid['IRR %'], expected, atol=1e-7)
+
+
+class BogleMonteCarloTests(unittest.TestCase):
+
+    def test_fixed_inputs_match_calcBogleForStock(self):
+        """ With nothing random every path is the one calcBogleForStock scenario """
+
+        class Tikr(object):
+            info = {'trailingPE': 25., 'dividendYield': .015}
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = mm.calcBogleForStock(Tikr, .04, [.07], [18])['TotalReturn'][0]
+
+        summary = mm.calcBogleMonteCarlo(25., .04, .015, earnings_growth=.07, future_pe=18, num_paths=100)
+        self.assertAlmostEqual(summary['p5'], expected)
+        self.assertAlmostEqual(summary['p95'], expected)
+        self.assertEqual(summary['P(beat TsyYield)'], float(expected > .04))
+
+    def test_seeded(self):
+        """ Same seed, same answer; draws from the Shiller history work too """
+
+        draws = mm.shiller_bootstrap(shiller_frame())
+        a = mm.calcBogleMonteCarlo(25., .04, num_paths=10000, seed=7, **draws)
+        b = mm.calcBogleMonteCarlo(25., .04, num_paths=10000, seed=7, **draws)
+
+        assert_series_equal(a, b)
+        self.assertLessEqual(a['p5'], a['p95'])
+
+
+class CachedTickerTests(unittest.TestCase):
+
+    """ Ticker info through the quote cache: one batch fetch, snapshot replay """
+
+    quotes = {'AAPL': {'dividendRate': .96, 'currentPrice': 180., 'dividendYield': .0053, 'trailingPE': 30.},
+              'KO': {'dividendRate': 1.84, 'currentPrice': 60., 'dividendYield': .031, 'trailingPE': 24.}}
+
+    def test_one_fetch(self):
+        provider = md.StaticQuoteProvider(self.quotes)
+        tickers = mm.get_tickers(['AAPL', 'KO'], md.QuoteCache(provider))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in tickers.values():
+                mm.calcIRRforTikr(t, .1, 20, .05)
+                mm.calcJBWforTikr(t, .04)
+                mm.calcBogleForStock(t, .04)
+
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(tickers['KO'].info['trailingPE'], 24.)
+
+    def test_snapshot_replay(self):
+        cache = md.QuoteCache(md.StaticQuoteProvider(self.quotes))
+        cache.prefetch(['AAPL', 'KO'])
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'quotes.json')
+            cache.save_snapshot(path)
+            replay = md.QuoteCache(md.StaticQuoteProvider(md.load_snapshot(path)))
+
+        self.assertEqual(mm.get_ticker('AAPL', replay).info, self.quotes['AAPL'])
+        self.assertRaises(KeyError, lambda: mm.get_ticker('MSFT', replay).info)
+
+    def test_bogle_grid(self):
+        """ Every (ticker, growth, P/E) row matches calcBogleForStock for that ticker """
+
+        cache = md.QuoteCache(md.StaticQuoteProvider(self.quotes))
+        grid = mm.calcBogleGrid(['AAPL', 'KO'], .04, [.05, .1], [15, 20, 30], quotes=cache)
+
+        self.assertEqual(len(grid), 12)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ko = mm.calcBogleForStock(mm.get_ticker('KO', cache), .04, [.05] * 3 + [.1] * 3, [15, 20, 30] * 2)
+
+        np.testing.assert_allclose(grid.loc[grid.Ticker == 'KO', 'TotalReturn'], ko['TotalReturn'])
+        # KO's lower P/E & higher yield beat AAPL in every scenario
+        self.assertTrue((grid.loc[grid.Ticker == 'KO', 'Rank'] == 1).all())
+
+
+class QuoteCacheTests(unittest.TestCase):
+
+    """ TTL & fallback in the quote cache; failed yfinance lookups """
+
+    def test_ttl(self):
+        now = [0.]
+        provider = md.StaticQuoteProvider(CachedTickerTests.quotes)
+        cache = md.QuoteCache(provider, ttl=60, clock=lambda: now[0])
+
+        cache.get_quotes(['KO', 'AAPL'])
+        now[0] = 59.
+        cache.get_quote('KO')
+        self.assertEqual(provider.calls, 1)
+
+        now[0] = 60.
+        cache.get_quote('KO')
+        self.assertEqual(provider.calls, 2)
+
+    def test_stale_quote_kept_when_refresh_fails(self):
+        now = [0.]
+        provider = md.StaticQuoteProvider({'KO': {'trailingPE': 24.}})
+        cache = md.QuoteCache(provider, ttl=60, clock=lambda: now[0])
+        cache.get_quote('KO')
+
+        provider.quotes = {}
+        now[0] = 120.
+        self.assertEqual(cache.get_quote('KO'), {'trailingPE': 24.})
+        self.assertRaises(KeyError, cache.get_quote, 'MSFT')
+
+    def test_failed_lookup_warns_once(self):
+        class Broken(object):
+            @property
+            def info(self):
+                raise requests.ConnectionError('offline')
+
+        tikrs = types.SimpleNamespace(tickers={'KO': Broken()})
+        provider = md.YFinanceProvider()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertIsNone(provider._info(tikrs, 'KO'))
+            self.assertIsNone(provider._info(tikrs, 'KO'))
+
+        self.assertEqual(out.getvalue(), "WARN: Couldn't fetch quote for KO: offline\n")
+
+    def test_other_errors_propagate(self):
+        # A bug, not a failed fetch
+        self.assertRaises(AttributeError, md.YFinanceProvider()._info, types.SimpleNamespace(), 'KO')
+
+
+class JBWSensitivityTests(unittest.TestCase):
+
+    def test_grid(self):
+        """ Matches the scalar version cell by cell and masks R <= g """
+
+        df = mm.calcJBWSensitivity({'GOOG': 4.04, 'AMZN': .589}, [.0189, .02], [.0, .04], [.02, .05])
+
+        self.assertEqual(len(df), 2 * 2 * 2 * 2)
+        for row in df.itertuples():
+            if row.R <= row.g:
+                self.assertTrue(np.isnan(row.Value))
+            else:
+                expected = mm.calcJBWFromShareholderYield({'GOOG': 4.04, 'AMZN': .589}[row.Ticker], row.tips_yield,
+                                                           row.risk_premium, row.g)
+                self.assertAlmostEqual(row.Value, expected)
+
+
+class BacktestTests(unittest.TestCase):
+
+    def setUp(self):
+        # Yield spread turns negative in Dec 2000, just before the market goes from +1%/month to -1%/month
+        months = pd.period_range('2000-01', '2001-12', freq='M', name='month')
+        self.tbl = pd.DataFrame({'DivYield': .02, 'TsyYield': [.03] * 11 + [.09] * 13, 'PE': 20., 'CAPE': 25.,
+                                 'GS10': [3.] * 11 + [9.] * 13,
+                                 'RealTotalReturnPrice': 100 * np.r_[1.01 ** np.arange(12), 1.01 ** 11 * .99 ** np.arange(1, 13)]},
+                                index=months)
+
+    def test_signal_sidesteps_fall(self):
+        """ Out of the market for the fall: no drawdown, every month called right a month ahead """
+
+        df = bt.backtest(self.tbl, 'JBW', [.05], horizon=1)
+
+        self.assertAlmostEqual(df.loc[0, 'MaxDrawdown'], 0)
+        self.assertAlmostEqual(df.loc[0, 'HoldDrawdown'], 1 - .99 ** 12)
+        self.assertAlmostEqual(df.loc[0, 'HitRate'], 1)
+        self.assertGreater(df.loc[0, 'AnnualReturn'], df.loc[0, 'HoldReturn'])
+
+    def test_sweep_matches_single_runs(self):
+        """ Sweeping a parameter is the same as running each value on its own """
+
+        sweep = bt.backtest(self.tbl, 'CAPE', [0., 2.5, 8.], horizon=3)
+        single = pd.concat([bt.backtest(self.tbl, 'CAPE', [p], horizon=3) for p in [0., 2.5, 8.]], ignore_index=True)
+
+        assert_frame_equal(sweep, single)
+        self.assertEqual(list(bt.backtest_all(self.tbl, horizon=3).Signal), ['JBW', 'Bogle', 'CAPE'])
+
+    def test_grid(self):
+        """ params x future_pe x horizon x hurdle, each row the same as a run of just that combination """
+
+        grid = bt.backtest(self.tbl, 'Bogle', [.05, .1], horizon=[1, 3], hurdle=[0., .05], future_pe=[10, 30])
+        self.assertEqual(len(grid), 16)
+
+        for row in grid.itertuples():
+            one = bt.backtest(self.tbl, 'Bogle', [row.Param], horizon=row.Horizon, hurdle=row.Hurdle, future_pe=row.FuturePE)
+            assert_series_equal(grid.loc[row.Index], one.loc[0], check_names=False)
+
+        # future_pe means nothing to the other signals
+        self.assertEqual(len(bt.backtest(self.tbl, 'JBW', [.05], horizon=[1, 3], future_pe=[10, 30])), 2)
+
+    def test_drawdown_from_start(self):
+        """ A loss starting in the very first month counts from the starting 1.0 """
+
+        equity = np.array([[.9, 1.1], [.95, 1.2], [.8, 1.3]])
+        np.testing.assert_allclose(bt.max_drawdown(equity), [.2, 0.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import edgar_utils as eu
+import http_transport as transport
+
+# Timings & peak memory for each stage of the EDGAR flow, per filer:
+#   flatten              companyfacts JSON -> facts frame (flatten_companyfacts)
+#   BalanceSheet, IncomeStatement, CashFlowStatement
+#                        tag alternates canonicalized, filtered & pivoted (both happen in the constructors)
+#   <Methodology>        report_qualitative for each methodology
+#   create_common_metrics
+#   excel                write_spreadsheet
+# Filers are companyfacts replayed from the http_transport cassettes (fixtures/cassettes, the same
+# recordings the tests use; --record fetches them from EDGAR first) plus synthetic large filers.
+# Every run is appended to a results file and compared against the previous run of the same filers.
+#
+#   python Stocks_Benchmark.py                      # KO & AAPL from cassettes + 2 synthetic ones
+#   python Stocks_Benchmark.py --record KO AAPL     # fetch & record KO & AAPL first
+#   python Stocks_Benchmark.py --synthetic 0 --repeat 5
+
+default_tickers = ['KO', 'AAPL']
+results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'bench', 'results.jsonl')
+
+# Every tag the statements read, so synthetic filers go through the whole flow
+instant_tags = ['LongTermDebtCurrent', 'MinorityInterest', 'PreferredStockIncludingAdditionalPaidInCapitalNetOfDiscount',
+                'OtherIntangibleAssetsNet', 'IndefiniteLivedTrademarks', 'OtherIndefiniteLivedAndFiniteLivedIntangibleAssets',
+                'RetainedEarningsAccumulatedDeficit', 'TreasuryStockValue', 'InventoryNet', 'MarketableSecurities',
+                'AccountsReceivableNetCurrent', 'CashAndCashEquivalentsAtCarryingValue', 'LongTermDebtNoncurrent', 'Assets',
+                'LiabilitiesCurrent', 'Liabilities', 'StockholdersEquity', 'LiabilitiesAndStockholdersEquity', 'AssetsCurrent',
+                'Goodwill', 'AccountsPayable', 'AccruedIncomeTaxesCurrent']
+
+period_tags = ['OperatingExpenses', 'IncomeTaxExpenseBenefit',
+               'IncomeLossFromContinuingOperationsBeforeIncomeTaxesExtraordinaryItemsNoncontrollingInterest',
+               'InterestExpense', 'SellingGeneralAndAdministrativeExpense', 'GrossProfit', 'Revenues', 'OperatingIncomeLoss',
+               'NetIncomeLoss', 'EarningsPerShareDiluted', 'WeightedAverageNumberOfDilutedSharesOutstanding',
+               'ProceedsFromIssuanceOfCommonStock', 'PaymentsForRepurchaseOfCommonStock', 'DepreciationDepletionAndAmortization',
+               'ShareBasedCompensation', 'NetCashProvidedByUsedInOperatingActivities', 'PaymentsToAcquirePropertyPlantAndEquipment',
+               'PaymentsOfDividends']
+
+
+def synthetic_companyfacts(seed=0, extra_tags=1500, years=range(2009, 2024)):
+    """
+    companyfacts-shaped JSON for a large filer: the statement tags plus extra_tags others, annual
+    & quarterly facts, each also repeated as a comparative in the following year's 10-K
+    """
+
+    rng = np.random.default_rng(seed)
+    tags = [(t, True) for t in instant_tags] + [(t, False) for t in period_tags]
+    tags += [('SyntheticTag%04d' % i, bool(i % 2)) for i in range(extra_tags)]
+
+    us_gaap = {}
+    for tag, instant in tags:
+        base = rng.uniform(1, 10) if tag == 'EarningsPerShareDiluted' else rng.uniform(1e8, 1e10)
+        facts = []
+        for y in years:
+            val = round(base * (1 + rng.normal(.05, .1)) ** (y - years[0]), 2)
+            for filed_year, frame in [(y + 1, 'CY%dQ4I' % y if instant else 'CY%d' % y), (y + 2, None)]:
+                fact = {'end': '%d-12-31' % y, 'val': val, 'accn': '0000000000-%02d-%06d' % (filed_year % 100, seed),
+                        'fy': filed_year - 1, 'fp': 'FY', 'form': '10-K', 'filed': '%d-02-20' % filed_year}
+                if not instant:
+                    fact['start'] = '%d-01-01' % y
+                if frame:
+                    fact['frame'] = frame
+                facts.append(fact)
+            for q, m in zip(range(1, 4), (3, 6, 9)):
+                fact = {'end': '%d-%02d-30' % (y, m), 'val': val if instant else round(val / 4, 2),
+                        'accn': '0000000000-%02d-%06d' % (y % 100, seed), 'fy': y, 'fp': 'Q%d' % q, 'form': '10-Q',
+                        'filed': '%d-%02d-15' % (y, m + 1), 'frame': 'CY%dQ%d%s' % (y, q, 'I' if instant else '')}
+                if not instant:
+                    fact['start'] = '%d-%02d-01' % (y, m - 2)
+                facts.append(fact)
+        us_gaap[tag] = {'label': tag, 'units': {'USD' if tag != 'EarningsPerShareDiluted' else 'USD/shares': facts}}
+
+    return {'cik': seed, 'entityName': 'Synthetic %d' % seed, 'facts': {'us-gaap': us_gaap}}
+
+def recorded_filers(tickers, mode='replay', root=None):
+    """
+    {ticker: companyfacts JSON} through the cassettes; mode='record' fetches from EDGAR and records.
+    Tickers with no cassette are skipped
+    """
+
+    filers = {}
+    with transport.use_cassettes(mode, root):
+        for t in tickers:
+            try:
+                filers[t] = eu.fetch_companyfacts(t)
+            except transport.MissingCassette as e:
+                print("WARN: Skipping " + t + ": " + str(e))
+    return filers
+
+
+class StageTimer(object):
+
+    """ Times each stage run through it and measures its peak memory over what was allocated before it started """
+
+    def __init__(self):
+        self.stages = []
+
+    def run(self, name, fn, *args):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+
+        self.stages.append({'stage': name, 'seconds': seconds, 'peak_mb': (peak - before) / 2 ** 20})
+        return result
+
+def bench_filer(company_json, ticker, out_dir, starting_year=2014):
+    """ One pass of the flow for one filer; returns [{stage, seconds, peak_mb}, ...] """
+
+    timer = StageTimer()
+
+    facts = timer.run('flatten', eu.flatten_companyfacts, company_json)
+
+    bs = timer.run('BalanceSheet', eu.BalanceSheet, facts, ticker, 0, starting_year)
+    income = timer.run('IncomeStatement', eu.IncomeStatement, facts, starting_year)
+    cfs = timer.run('CashFlowStatement', eu.CashFlowStatement, facts, starting_year)
+
+    methods = [eu.Mizrahi(bs, income, cfs), eu.Safal(bs, income, cfs), eu.Buffett(bs, income, cfs),
+               eu.ThreeBrians(bs, income, cfs), eu.KJMarshall(ticker, bs, income, cfs)]
+    for m in methods:
+        timer.run(m.name, m.report_qualitative)
+
+    common_df = timer.run('create_common_metrics', eu.create_common_metrics, *methods[:4])
+    timer.run('excel', eu.write_spreadsheet, os.path.join(out_dir, ticker + '.xlsx'), common_df, *methods)
+
+    return timer.stages
+
+def run(filers, repeat=3):
+    """
+    filers: {name: companyfacts JSON}
+    Each filer is run repeat times; the fastest time & lowest peak per stage are kept
+    """
+
+    results = {}
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name, company_json in filers.items():
+                runs = [bench_filer(company_json, name, out_dir) for _ in range(repeat)]
+                results[name] = [{'stage': stages[0]['stage'],
+                                  'seconds': min(s['seconds'] for s in stages),
+                                  'peak_mb': min(s['peak_mb'] for s in stages)}
+                                 for stages in zip(*runs)]
+    finally:
+        tracemalloc.stop()
+
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_settings(recorded, synthetic, extra_tags, repeat):
+    """ What makes two runs comparable: each filer & whether it's recorded or synthetic, the synthetic size and repeat """
+
+    filers = dict({name: 'recorded' for name in recorded}, **{name: 'synthetic' for name in synthetic})
+    return {'filers': filers, 'extra_tags': extra_tags if synthetic else None, 'repeat': repeat}
+
+def previous_run(path, settings):
+    """ Last stored run made with the same settings (run_settings); a different run would only compare noise """
+
+    if not os.path.exists(path):
+        return None
+
+    previous = None
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('settings') == settings:
+                previous = entry
+    return previous
+
+def save_run(path, results, settings):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {'when': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+             'settings': settings, 'results': results}
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    return entry
+
+def report(results, previous=None):
+    lines = []
+    for name, stages in results.items():
+        lines.append(name)
+        before = {s['stage']: s for s in previous['results'][name]} if previous else {}
+        for s in stages:
+            line = '  %-24s %9.4fs %9.1f MB' % (s['stage'], s['seconds'], s['peak_mb'])
+            if s['stage'] in before:
+                old = before[s['stage']]
+                line += '   %+7.1f%% time %+7.1f%% mem' % (100 * (s['seconds'] / old['seconds'] - 1) if old['seconds'] else 0,
+                                                         100 * (s['peak_mb'] / old['peak_mb'] - 1) if old['peak_mb'] else 0)
+            lines.append(line)
+    if previous:
+        lines.append('(compared with %s, revision %s)' % (previous['when'], previous['revision']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the EDGAR ingest, statement & methodology stages')
+    parser.add_argument('tickers', nargs='*', default=default_tickers, help='filers replayed from cassettes')
+    parser.add_argument('--record', action='store_true', help='fetch the tickers from EDGAR & record them first')
+    parser.add_argument('--synthetic', type=int, default=2, help='number of synthetic large filers')
+    parser.add_argument('--extra-tags', type=int, default=1500, help='tags per synthetic filer beyond the statement ones')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--results', default=results_path, help='JSON lines file runs are appended to')
+    args = parser.parse_args()
+
+    recorded = recorded_filers(args.tickers, 'record' if args.record else 'replay')
+    synthetic = {'SYNTH%d' % i: synthetic_companyfacts(seed=i, extra_tags=args.extra_tags) for i in range(args.synthetic)}
+    settings = run_settings(recorded, synthetic, args.extra_tags, args.repeat)
+
+    results = run(dict(recorded, **synthetic), args.repeat)
+    previous = previous_run(args.results, settings)
+    save_run(args.results, results, settings)
+
+    print(report(results, previous))
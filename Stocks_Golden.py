@@ -0,0 +1,117 @@
+import argparse
+import functools
+import os
+
+import pandas as pd
+
+import edgar_utils as eu
+import http_transport as transport
+
+# Expected statements for the DFTests, one Parquet file per ticker & statement under fixtures/golden
+# (<TICKER>-bs.parquet, -income, -cfs). They're read on first use and cached for the whole test
+# session, so a ticker's goldens cost nothing until a test asks for them.
+# Regenerate them from the replay cassettes after a deliberate change to the statements, or to
+# add a ticker (record its cassettes first):
+#
+#   python Stocks_Golden.py                                     # every ticker that already has goldens
+#   python Stocks_Golden.py CMG FLS GAP                         # replay cassettes must exist
+#   STOCKS_HTTP_MODE=record python Stocks_Golden.py --trim CMG  # fetch from EDGAR, record (trimmed) & write goldens
+
+golden_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'golden')
+
+statements = ['bs', 'income', 'cfs']
+starting_year = 2014
+
+# Tags dropped from a ticker's facts before building a statement (alternates that would
+# otherwise win over the tag the test expects)
+drop_tags = {'KO': {'bs': ['FiniteLivedIntangibleAssetsNet', 'InventoryFinishedGoodsNetOfReserves'],
+                    'cfs': ['Depreciation']},
+             'AAPL': {'bs': ['FiniteLivedIntangibleAssetsNet', 'InventoryFinishedGoodsNetOfReserves'],
+                      'cfs': ['PaymentsToAcquireProductiveAssets', 'Depreciation']}}
+
+
+def golden_path(ticker, statement, root=golden_dir):
+    return os.path.join(root, ticker + '-' + statement + '.parquet')
+
+def golden_tickers(root=golden_dir):
+    if not os.path.isdir(root):
+        return []
+    return sorted({f.rsplit('-', 1)[0] for f in os.listdir(root) if f.endswith('.parquet')})
+
+@functools.lru_cache(maxsize=None)
+def golden(ticker, statement, root=golden_dir):
+    """ Expected statement frame (fy x tag). Shared by every test that asks: don't modify it, .copy() it """
+    return pd.read_parquet(golden_path(ticker, statement, root))
+
+def golden_companyfacts(ticker, root=golden_dir):
+    """
+    companyfacts-shaped JSON holding exactly the figures in a ticker's goldens: one 10-K fact per
+    fy & tag, balance sheet tags as Dec 31 instants and the rest as CY#### periods.
+    Not what EDGAR serves (no comparatives, amendments or alternate tags), but it puts the goldens'
+    real numbers through build_statement when the recorded cassettes aren't around
+    """
+
+    units = {'EarningsPerShareDiluted': 'USD/shares', 'WeightedAverageNumberOfDilutedSharesOutstanding': 'shares'}
+
+    us_gaap = {}
+    for s in statements:
+        df = golden(ticker, s, root)
+        for tag in df.columns:
+            facts = []
+            for fy, val in df[tag].dropna().items():
+                fact = {'end': '%d-12-31' % fy, 'val': val, 'accn': '0000000000-%02d-000000' % ((fy + 1) % 100),
+                        'fy': fy, 'fp': 'FY', 'form': '10-K', 'filed': '%d-02-20' % (fy + 1)}
+                if s != 'bs':
+                    fact.update(start='%d-01-01' % fy, frame='CY%d' % fy)
+                facts.append(fact)
+            if facts:
+                us_gaap[tag] = {'label': tag, 'units': {units.get(tag, 'USD'): facts}}
+
+    return {'cik': 0, 'entityName': ticker, 'facts': {'us-gaap': us_gaap}}
+
+def build_statement(facts, ticker, statement):
+    """ The statement the goldens are checked against, from a ticker's facts (get_json_financials_from_tikr) """
+
+    drop = drop_tags.get(ticker, {}).get(statement)
+    if drop:
+        facts = facts[~facts.tag.isin(drop)]
+
+    if statement == 'bs':
+        return eu.BalanceSheet(facts, ticker, 0, starting_year)
+    if statement == 'income':
+        return eu.IncomeStatement(facts, starting_year)
+    if statement == 'cfs':
+        return eu.CashFlowStatement(facts, starting_year)
+    raise ValueError("statement should be 'bs', 'income' or 'cfs'")
+
+def regenerate(tickers, root=golden_dir, cassettes=None, trim=False):
+    """
+    Rebuild & overwrite the goldens for tickers from cassettes (replay, unless STOCKS_HTTP_MODE says otherwise).
+    cassettes: folder to replay from, defaults to fixtures/cassettes
+    trim: shrink each companyfacts cassette to what the statements read before building (see trim_companyfacts)
+    """
+
+    os.makedirs(root, exist_ok=True)
+    with transport.use_cassettes(root=cassettes):
+        for t in tickers:
+            eu.fetch_companyfacts(t)
+            if trim:
+                eu.trim_companyfacts_cassette(t, cassettes)
+
+    with transport.use_cassettes('replay', cassettes):
+        for t in tickers:
+            facts = eu.get_json_financials_from_tikr(t)
+            for s in statements:
+                build_statement(facts, t, s).df.to_parquet(golden_path(t, s, root), compression='zstd', write_statistics=False)
+            print(t + ': ' + ', '.join(os.path.basename(golden_path(t, s, root)) for s in statements))
+
+    golden.cache_clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the expected statement Parquet files from cassettes')
+    parser.add_argument('tickers', nargs='*', help='defaults to every ticker with goldens already')
+    parser.add_argument('--trim', action='store_true', help='trim the companyfacts cassettes to the 10-K/8-K facts first')
+    args = parser.parse_args()
+
+    regenerate(args.tickers or golden_tickers(), trim=args.trim)
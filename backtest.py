@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+import macro_data as macro
+
+# Backtests of the index signals in money_machine over the whole macro frame
+# (money_machine.get_macro_dataset). Each month a signal says in (> 0) or out (<= 0) of the market;
+# the position is taken at the end of that month and earns next month's change in Shiller's real
+# total return price, so a signal never sees the return it's judged on. Out of the market earns 0.
+#
+# Signals, with the assumption that gets swept (params) for each:
+#   JBW    DivYield + growth - TsyYield                    params = growth rates (calcJBWSP500 uses .05)
+#   Bogle  DivYield + growth + P/E change - TsyYield       params = growth rates, P/E heading to future_pe
+#   CAPE   100/CAPE - (GS10 - inflation)                   params = inflation in % (calcShillerCAEP uses 2.5)
+# Every parameter value is a column of one months x params matrix, so a sweep is a single pass.
+# horizon & hurdle (how hit rate is judged) and Bogle's future_pe can be lists too; backtest
+# returns a row for every combination of them with params.
+
+default_params = {'JBW': [.05], 'Bogle': [.05], 'CAPE': [2.5]}
+
+
+def signal_matrix(tbl, signal, params=None, future_pe=15, years=10):
+    """ months x params frame of the signal's spread; > 0 means in the market """
+
+    params = np.asarray(params if params is not None else default_params[signal], dtype=float)
+    col = lambda name: tbl[name].to_numpy(dtype=float)[:, None]
+
+    if signal == 'JBW':
+        spread = col('DivYield') + params[None, :] - col('TsyYield')
+    elif signal == 'Bogle':
+        pe_growth = pow(future_pe / col('PE'), 1 / years) - 1
+        spread = col('DivYield') + params[None, :] + pe_growth - col('TsyYield')
+    elif signal == 'CAPE':
+        spread = 100 / col('CAPE') - (col('GS10') - params[None, :])
+    else:
+        raise ValueError("signal should be 'JBW', 'Bogle' or 'CAPE'")
+
+    return pd.DataFrame(spread, index=tbl.index, columns=pd.Index(params, name='param'))
+
+def forward_returns(price, horizon):
+    """ Annualized return from each month to horizon months later (NaN where history runs out) """
+
+    price = np.asarray(price, dtype=float)
+    fwd = np.full(len(price), np.nan)
+    if horizon < len(price):
+        fwd[:len(price) - horizon] = (price[horizon:] / price[:-horizon]) ** (12 / horizon) - 1
+    return fwd
+
+def max_drawdown(equity):
+    """
+    Largest peak-to-trough fall of each column of an equity curve matrix (as a positive fraction).
+    Curves start from 1, so a fall that begins in the first month counts from there
+    """
+
+    equity = np.vstack([np.ones((1, equity.shape[1])), equity])
+    return np.nanmax(1 - equity / np.maximum.accumulate(equity, axis=0), axis=0)
+
+def backtest(tbl, signal, params=None, start=None, end=None, horizon=120, hurdle=0., future_pe=15):
+    """
+    Run signal over tbl (optionally start..end) for every value in params, over the months where
+    both the signal and the real total return price exist.
+    hit_rate: share of months where in/out agreed with whether the next horizon months' annualized
+    real total return beat hurdle. HoldReturn/HoldDrawdown are buy & hold over the same months
+    horizon, hurdle & future_pe take one value or a list (future_pe only matters for Bogle)
+    Returns one row per combination of param, future_pe, horizon & hurdle
+    """
+
+    rows = macro.select_months(tbl, slice(start, end))
+    rows = rows[rows['RealTotalReturnPrice'].notna()]
+
+    results = []
+    for pe in np.atleast_1d(future_pe) if signal == 'Bogle' else [np.nan]:
+        spread = signal_matrix(rows, signal, params, pe)
+        has_signal = spread.notna().all(axis=1).to_numpy()
+        months_used, spread = rows[has_signal], spread[has_signal]
+        if len(months_used) < 2:
+            raise ValueError('Not enough months with both ' + signal + ' inputs and Shiller prices')
+
+        invested = spread.to_numpy() > 0
+        price = months_used['RealTotalReturnPrice'].to_numpy(dtype=float)
+        monthly = price[1:] / price[:-1] - 1
+        months = len(monthly)
+
+        # Position set at the end of month t earns month t+1's return
+        equity = np.cumprod(1 + invested[:-1] * monthly[:, None], axis=0)
+        hold = np.cumprod(1 + monthly)[:, None]
+
+        performance = {'Start': months_used.index[0],
+                       'End': months_used.index[-1],
+                       'TimeInMarket': invested[:-1].mean(axis=0),
+                       'AnnualReturn': equity[-1] ** (12 / months) - 1,
+                       'MaxDrawdown': max_drawdown(equity),
+                       'HoldReturn': hold[-1, 0] ** (12 / months) - 1,
+                       'HoldDrawdown': max_drawdown(hold)[0]}
+
+        # Only the hit rate depends on horizon & hurdle
+        for h in np.atleast_1d(horizon):
+            fwd = forward_returns(price, int(h))
+            judged = ~np.isnan(fwd)
+            for hr in np.atleast_1d(hurdle):
+                hits = (invested == (fwd > hr)[:, None])[judged]
+                results.append(pd.DataFrame(dict({'Signal': signal, 'Param': spread.columns, 'FuturePE': pe,
+                                                  'Horizon': int(h), 'Hurdle': hr,
+                                                  'HitRate': hits.mean(axis=0) if judged.any() else np.nan},
+                                                 **performance)))
+
+    columns = ['Signal', 'Param', 'FuturePE', 'Horizon', 'Hurdle', 'Start', 'End', 'TimeInMarket', 'HitRate',
+               'AnnualReturn', 'MaxDrawdown', 'HoldReturn', 'HoldDrawdown']
+    return pd.concat(results, ignore_index=True)[columns]
+
+def backtest_all(tbl, params=None, **kwargs):
+    """
+    backtest for JBW, Bogle & CAPE together; params: {signal: values} overriding default_params.
+    kwargs (start, end, horizon, hurdle, future_pe) go to every backtest
+    """
+
+    params = dict(default_params, **(params or {}))
+    return pd.concat([backtest(tbl, s, params[s], **kwargs) for s in ['JBW', 'Bogle', 'CAPE']], ignore_index=True)
@@ -0,0 +1,243 @@
+import html
+import json
+import math
+import os
+
+import numpy as np
+
+import edgar_utils as eu
+
+# Static HTML site for a whole universe, built from a FactStore with no network access.
+#   index.html, page-2.html, ...   paginated ticker list with a search box
+#   search_index.json              precomputed index the search box filters client side
+#   fragments/<TICKER>.html        per-ticker tables, only fetched when a ticker is opened
+#   manifest.json                  facts version + summary per ticker; unchanged tickers aren't re-rendered
+# The pages load fragments & the index with fetch(), so serve the folder (python -m http.server)
+# rather than opening the files directly.
+
+# Bump when the fragment layout changes so every ticker is re-rendered once
+layout_version = 1
+
+# Latest-year values shown in the ticker list & search index
+summary_metrics = ['Sales', 'Sales_YoY', 'ROE', 'NPM', 'OperatingMargin', 'FCF']
+
+page_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; font-size: 12px; }}
+td, th {{ border: 1px solid #ddd; padding: 2px 6px; text-align: right; }}
+.ticker {{ cursor: pointer; color: #0645ad; }}
+.fragment {{ margin: 1em 0 2em 0; overflow-x: auto; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<input id="search" placeholder="Search tickers..." size="40">
+<ul id="results"></ul>
+<table>
+<tr><th>Ticker</th><th>Years</th>{summary_headers}</tr>
+{rows}
+</table>
+<p>{pager}</p>
+<div id="detail"></div>
+<script>
+function openTicker(t) {{
+  fetch('fragments/' + encodeURIComponent(t) + '.html').then(r => r.text()).then(h => {{
+    const detail = document.getElementById('detail');
+    const heading = document.createElement('h2');
+    const fragment = document.createElement('div');
+    heading.textContent = t;
+    fragment.className = 'fragment';
+    fragment.innerHTML = h;
+    detail.replaceChildren(heading, fragment);
+    detail.scrollIntoView();
+  }});
+}}
+let index = null;
+document.getElementById('search').addEventListener('input', e => {{
+  const q = e.target.value.trim().toUpperCase();
+  // Built as elements, not HTML strings, so nothing in a ticker is ever parsed as markup
+  const item = x => {{
+    const li = document.createElement('li');
+    const link = document.createElement('a');
+    const details = document.createElement('span');
+    link.href = x.page;
+    link.textContent = x.name ? x.ticker + ' - ' + x.name : x.ticker;
+    details.className = 'ticker';
+    details.textContent = 'details';
+    details.onclick = () => openTicker(x.ticker);
+    li.append(link, ' ', details);
+    return li;
+  }};
+  const show = entries => {{
+    document.getElementById('results').replaceChildren(...(q ? entries
+      .filter(x => x.ticker.startsWith(q) || x.keywords.some(k => k.startsWith(q)))
+      .slice(0, 20)
+      .map(item) : []));
+  }};
+  if (index) {{ show(index); }}
+  else {{ fetch('search_index.json').then(r => r.json()).then(j => {{ index = j; show(index); }}); }}
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def _summary(common_df):
+    """ Latest-year values of summary_metrics, as plain floats (None for missing) for JSON """
+
+    if common_df is None or common_df.empty:
+        return {}
+
+    latest = common_df.iloc[-1]
+    summary = {'fy': int(common_df.index[-1])}
+    for c in summary_metrics:
+        if c in latest.index:
+            v = latest[c]
+            # A column can survive dedup twice under one name; the first copy is the one shown
+            v = v.iloc[0] if hasattr(v, 'iloc') else v
+            summary[c] = None if v is None or (isinstance(v, float) and not np.isfinite(v)) else float(v)
+
+    summary['years'] = [int(common_df.index.min()), int(common_df.index.max())]
+    return summary
+
+def render_fragment(common_df, methods):
+    """ Per-ticker HTML: the common metrics, then each methodology's metrics & report """
+
+    parts = ['<h3>Common</h3>', common_df.to_html(float_format='{:,.4g}'.format, na_rep='')]
+
+    for m in methods:
+        parts.append('<h3>' + html.escape(m.name) + '</h3>')
+        if m.pretty_columns is not None:
+            parts.append(m.pretty_html())
+        else:
+            parts.append(m.metrics.to_html(float_format='{:,.4g}'.format, na_rep=''))
+        parts.append(m.report.to_html(na_rep=''))
+
+    return '\n'.join(parts)
+
+def _fmt(v, metric):
+    if v is None:
+        return ''
+    if metric in ('Sales', 'FCF'):
+        return '{:,.0f}'.format(v)
+    return '{:.2%}'.format(v)
+
+def search_keywords(ticker, profile):
+    """
+    What the search box matches on (upper case, prefix matched): the ticker, the company name
+    & each word of it, the SIC code & the words of its description
+    """
+
+    name = profile.get('name') or ''
+    description = profile.get('sic_description') or ''
+
+    keywords = [ticker, name] + name.split() + [profile.get('sic') or ''] + description.split()
+    keywords = [k.upper() for k in keywords if k]
+
+    return list(dict.fromkeys(keywords))
+
+def _page_name(page):
+    return 'index.html' if page == 1 else 'page-%d.html' % page
+
+def render_pages(out_dir, manifest, page_size, title):
+
+    tickers = sorted(manifest)
+    num_pages = max(1, math.ceil(len(tickers) / page_size))
+    search_index = []
+
+    for page in range(1, num_pages + 1):
+        rows = []
+        for t in tickers[(page - 1) * page_size: page * page_size]:
+            entry = manifest[t]
+            summary = entry.get('summary', {})
+            years = summary.get('years')
+            cells = ''.join('<td>%s</td>' % _fmt(summary.get(c), c) for c in summary_metrics)
+
+            # json.dumps makes t a JS string literal, html.escape makes that safe inside the attribute
+            rows.append('<tr><td class="ticker" onclick="openTicker(%s)">%s</td><td>%s</td>%s</tr>'
+                        % (html.escape(json.dumps(t)), html.escape(t),
+                           '%d-%d' % tuple(years) if years else html.escape(entry.get('error', '')), cells))
+
+            search_index.append({'ticker': t,
+                                 'name': entry.get('name'),
+                                 'keywords': entry.get('keywords', [t]),
+                                 'page': _page_name(page),
+                                 'summary': summary})
+
+        pager = ' '.join('<a href="%s">%d</a>' % (_page_name(p), p) if p != page else '<b>%d</b>' % p
+                         for p in range(1, num_pages + 1))
+
+        with open(os.path.join(out_dir, _page_name(page)), 'w') as f:
+            f.write(page_template.format(title=html.escape(title),
+                                         summary_headers=''.join('<th>%s</th>' % c for c in summary_metrics),
+                                         rows='\n'.join(rows), pager=pager))
+
+    with open(os.path.join(out_dir, 'search_index.json'), 'w') as f:
+        json.dump(search_index, f, separators=(',', ':'))
+
+def build_dashboard(store, out_dir, tickers=None, page_size=50, ticker_options=None, title='Stock Metrics'):
+    """
+    store: fact_store.FactStore with the facts already fetched
+    tickers: defaults to every ticker in the store
+    ticker_options: ticker -> kwargs for edgar_utils.analyze_ticker (starting_year, offset_fy, drop_tags)
+    Returns the list of tickers that were (re-)rendered
+    """
+
+    ticker_options = ticker_options or {}
+    tickers = tickers if tickers is not None else store.tickers()
+
+    os.makedirs(os.path.join(out_dir, 'fragments'), exist_ok=True)
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    rendered = []
+    for t in tickers:
+        # Search terms come from the stored profile, which can turn up after the facts; always refreshed
+        profile = store.load_profile(t)
+        search = {'name': profile.get('name'), 'keywords': search_keywords(t, profile)}
+        if t in manifest:
+            manifest[t].update(search)
+
+        options = ticker_options.get(t, {})
+        # options go into the version too; changing offset_fy or drop_tags changes the output
+        version = '%s:%d:%s' % (store.facts_version(t), layout_version, json.dumps(options, sort_keys=True, default=list))
+        fragment_path = os.path.join(out_dir, 'fragments', t + '.html')
+
+        if manifest.get(t, {}).get('version') == version and os.path.exists(fragment_path):
+            continue
+
+        entry = dict(search, version=version)
+        try:
+            common_df, methods = eu.analyze_ticker(store.load_facts(t), t, **options)
+            fragment = render_fragment(common_df, methods)
+            entry['summary'] = _summary(common_df)
+        except (ValueError, KeyError, OSError) as e:
+            # Usually clashing tag alternates (needs drop_tags in ticker_options) or a sparse filer
+            print("WARN: Couldn't build " + t + ": " + str(e))
+            fragment = '<p>' + html.escape(str(e)) + '</p>'
+            entry['error'] = str(e)
+
+        with open(fragment_path, 'w') as f:
+            f.write(fragment)
+
+        manifest[t] = entry
+        rendered.append(t)
+
+    # Pages & search index are cheap; they're always rebuilt from the whole manifest, so building
+    # a few tickers doesn't drop the ones built before from the list or the search
+    render_pages(out_dir, manifest, page_size, title)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    return rendered
@@ -1,11 +1,17 @@
+import collections
 import datetime
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import re
 import matplotlib as plt
 import matplotlib.dates as mdates
 import numpy as np
-import requests
-import yfinance as yf
+
+import http_transport as transport
+import market_data as md
+import report_export
 
 bs_tag_alternates = {"AccountsPayableAndAccruedLiabilitiesCurrent":"AccountsPayable",
                      "AccountsPayableCurrent":"AccountsPayable",
@@ -22,49 +28,116 @@ is_tag_alternates = {'RevenueFromContractWithCustomerExcludingAssessedTax':"Reve
 cf_tag_alternates = {'PaymentsToAcquireProductiveAssets':'PaymentsToAcquirePropertyPlantAndEquipment',
                      'Depreciation':'DepreciationDepletionAndAmortization'}
 
+# Dividends paid, in order of preference; filers use one or the other (some report both, same number)
+dividend_tags = ['PaymentsOfDividends', 'PaymentsOfDividendsCommonStock']
 
-def get_json_financials_from_tikr(stock_ticker):
 
+sec_headers = {'User-Agent': "your@email.com"}
 
-    # Below is from: https://medium.datadriveninvestor.com/access-companies-sec-filings-using-python-760e6075d3ad
+@functools.lru_cache(maxsize=1)
+def get_tickers_cik():
+    """ SEC ticker -> CIK table; only changes occasionally so it's fetched once per session """
 
-    headers = {'User-Agent': "your@email.com"}
-    tickers_cik = requests.get("https://www.sec.gov/files/company_tickers.json", headers=headers)
+    tickers_cik = transport.get("https://www.sec.gov/files/company_tickers.json", headers=sec_headers)
 
     tickers_cik = pd.json_normalize(pd.json_normalize(tickers_cik.json(), max_level=0).values[0])
     tickers_cik["cik_str"] = tickers_cik["cik_str"].astype(str).str.zfill(10)
     tickers_cik.set_index("ticker",inplace=True)
 
-    cik = tickers_cik.loc[stock_ticker]['cik_str']
+    return tickers_cik
+
+def get_cik(stock_ticker):
+    return get_tickers_cik().loc[stock_ticker]['cik_str']
+
+@functools.lru_cache(maxsize=None)
+def get_company_profile(stock_ticker):
+    """ Name & SIC of the company from its EDGAR submissions record; fetched once per ticker per session """
+
+    url = 'https://data.sec.gov/submissions/CIK' + get_cik(stock_ticker) + '.json'
+    submissions = transport.get(url, headers = sec_headers).json()
+
+    return {'name': submissions.get('name'), 'sic': submissions['sic'], 'sic_description': submissions.get('sicDescription')}
 
-    url = 'https://data.sec.gov/api/xbrl/companyfacts/CIK' + cik + '.json'
-    response = requests.get(url, headers = headers)
+def get_sic_code(stock_ticker):
+    """ SIC code of the company, e.g. '2080' for KO """
+    return get_company_profile(stock_ticker)['sic']
+
+def get_sic_codes(tickers, digits=4, max_workers=4):
+    """
+    ticker -> SIC code for a list of tickers; usable as peer_groups in rank_universe.
+    digits=2 groups by SIC major group (e.g. all of 20xx food & beverage) for broader peer sets
+    Tickers not looked up yet are fetched a few at a time; SEC allows 10 requests/s
+    """
+
+    tickers = list(tickers)
+    get_tickers_cik()  # once, before the workers all miss the cache together
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        codes = list(ex.map(get_sic_code, tickers))
+
+    return {t: code[:digits] for t, code in zip(tickers, codes)}
+
+def companyfacts_url(stock_ticker):
+    return 'https://data.sec.gov/api/xbrl/companyfacts/CIK' + get_cik(stock_ticker) + '.json'
+
+def fetch_companyfacts(stock_ticker):
+    """ Raw companyfacts JSON (as a dict) for the ticker """
+
+    # Below is from: https://medium.datadriveninvestor.com/access-companies-sec-filings-using-python-760e6075d3ad
 
-    tags = list(response.json()['facts']['us-gaap'].keys())
-    company_data = pd.DataFrame()
+    headers = sec_headers
 
-    for i in range(len(tags)):
+    response = transport.get(companyfacts_url(stock_ticker), headers = headers)
+
+    return response.json()
+
+def trim_companyfacts(company_json, forms=('10-K', '8-K')):
+    """ companyfacts with only the facts from forms (what the statements read) and no empty tags """
+
+    trimmed = {}
+    for tag, spec in company_json['facts'].get('us-gaap', {}).items():
+        units = {u: [f for f in facts if f.get('form') in forms] for u, facts in spec.get('units', {}).items()}
+        units = {u: facts for u, facts in units.items() if facts}
+        if units:
+            trimmed[tag] = dict(spec, units=units)
+
+    return dict(company_json, facts={'us-gaap': trimmed})
+
+def trim_companyfacts_cassette(stock_ticker, root=None):
+    """
+    Shrink a recorded companyfacts cassette to trim_companyfacts; the statements built from it don't change.
+    Record first: with transport.use_cassettes('record'): fetch_companyfacts('KO')
+    """
+
+    with transport.use_cassettes('replay', root):
+        url = companyfacts_url(stock_ticker)
+
+    transport.rewrite_cassette(url, lambda body: json.dumps(trim_companyfacts(json.loads(body))).encode(), root)
+
+def flatten_companyfacts(company_json):
+    """ One row per us-gaap fact (end, val, accn, fy, fp, form, filed, frame, ..., tag, units) """
+
+    us_gaap = company_json['facts']['us-gaap']
+
+    # Collect every fact first and build the frame once; concat per tag/unit copies everything so far each time
+    records = []
+    for tag in us_gaap:
         try:
-            tag = tags[i]
-            # units=list(response.json()['facts']['us-gaap'][tag]['units'].keys())[0]
-            units=list(response.json()['facts']['us-gaap'][tag]['units'].keys())
-
-            for j in range(len(units)):
-                
-                data = pd.json_normalize(response.json()['facts']['us-gaap'][tag]['units'][units[j]])
-                data['tag'] = tag
-                data['units'] = units[j]
-              
-                company_data = pd.concat([company_data, data], ignore_index=True)
-        except:
+            for unit, facts in us_gaap[tag]['units'].items():
+                records.extend(dict(fact, tag=tag, units=unit) for fact in facts)
+        except (KeyError, AttributeError, TypeError):
             print(tag + ' not found.')
 
+    company_data = pd.DataFrame.from_records(records)
+
     # Convert date strings to proper dates
     company_data['end']= pd.to_datetime(company_data['end'])
     company_data['filed']= pd.to_datetime(company_data['filed'])
 
     return company_data
 
+def get_json_financials_from_tikr(stock_ticker):
+    return flatten_companyfacts(fetch_companyfacts(stock_ticker))
+
 def check_for_no_conflicts(k, v, df):
 
     x = df[df.tag.isin([k,v])]
@@ -208,7 +281,8 @@ class IncomeStatement(FinStatement):
 
 class CashFlowStatement(FinStatement):
 
-    def __init__(self, df, starting_year, ending_year=None):
+    def __init__(self, df, starting_year, ending_year=None, extra_attribs=()):
+        """ extra_attribs: tags to keep on top of the usual ones, e.g. dividend_tags for shareholder_payout_per_share """
         FinStatement.__init__(self, df, starting_year, ending_year)
 
         for k, v in cf_tag_alternates.items():
@@ -222,6 +296,7 @@ class CashFlowStatement(FinStatement):
         self.df = filterPeriodStatement(self.df)
 
         self.attribs = ['ProceedsFromIssuanceOfCommonStock','PaymentsForRepurchaseOfCommonStock','DepreciationDepletionAndAmortization','ShareBasedCompensation','NetCashProvidedByUsedInOperatingActivities','PaymentsToAcquirePropertyPlantAndEquipment']
+        self.attribs = self.attribs + [a for a in extra_attribs if a not in self.attribs]
         self.df = self.df[(self.df.tag.isin(self.attribs) & (self.df.fy >= starting_year))]
 
         if ending_year:
@@ -235,6 +310,118 @@ class CashFlowStatement(FinStatement):
         self.df.loc[:,attrib_diffs]=np.nan
 
 
+# Growth kernels
+# These work on flat numpy arrays sorted by (segment, year), where a segment is one company.
+# offsets holds the start row of every segment plus the total length, so segment k is
+# values[offsets[k]:offsets[k+1]]. Growth never crosses a segment boundary, and the
+# previous year is looked up by year, not by row, so a gap in the years gives NaN.
+
+def segment_offsets(keys):
+    """ Start offsets of each run of equal keys in a sorted array, plus the total length """
+
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return np.concatenate(([0], starts, [len(keys)])).astype(np.int64)
+
+def _lagged_positions(years, offsets, lag):
+    """ Row holding the same segment's value lag years earlier, or -1 if that year is missing """
+
+    years = np.asarray(years, dtype=np.int64)
+    n = len(years)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Fold (segment, year) into one sorted int key, then the lagged row is a single searchsorted
+    segment = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    span = years.max() - years.min() + lag + 1
+    key = segment * span + (years - years.min())
+
+    target = key - lag
+    pos = np.searchsorted(key, target)
+    found = (pos < n) & (key[np.minimum(pos, n - 1)] == target)
+
+    return np.where(found, pos, -1)
+
+def _lagged_values(values, years, offsets, lag):
+    values = np.asarray(values, dtype=np.float64)
+    pos = _lagged_positions(years, offsets, lag)
+
+    prev = np.full(len(values), np.nan)
+    prev[pos >= 0] = values[pos[pos >= 0]]
+    return prev
+
+def grouped_yoy(values, years, offsets, periods=1):
+    """ Same as pct_change(periods) within each segment, but NaN when the year periods back is missing """
+
+    values = np.asarray(values, dtype=np.float64)
+    prev = _lagged_values(values, years, offsets, periods)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / prev - 1
+
+def grouped_cagr(values, years, offsets, num_years):
+    """ Compound annual growth over num_years within each segment; NaN for missing years or sign flips """
+
+    values = np.asarray(values, dtype=np.float64)
+    prev = _lagged_values(values, years, offsets, num_years)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.power(values / prev, 1.0 / num_years) - 1
+
+def grouped_growth_streak(values, years, offsets):
+    """ Number of consecutive years of positive YoY growth ending at each row """
+
+    growing = grouped_yoy(values, years, offsets) > 0
+    idx = np.arange(len(growing))
+
+    # Running count of growing rows, reset at the last row that didn't grow.
+    # Every segment's first row has no prior year so it is always a reset point.
+    count = np.cumsum(growing)
+    last_reset = np.maximum.accumulate(np.where(~growing, idx, 0))
+
+    return count - count[last_reset]
+
+def _panel_arrays(s):
+    """
+    Flatten a Series indexed by fy, or by (ticker, fy), into the sorted arrays the kernels want.
+    Also returns the order used, so results can be put back against the original index
+    """
+
+    if isinstance(s.index, pd.MultiIndex):
+        keys = pd.factorize(s.index.get_level_values(0))[0]
+        years = s.index.get_level_values(-1)
+    else:
+        keys = np.zeros(len(s), dtype=np.int64)
+        years = s.index
+
+    years = np.asarray(years, dtype=np.int64)
+    order = np.lexsort((years, keys))
+
+    return s.to_numpy(dtype=np.float64, na_value=np.nan)[order], years[order], segment_offsets(keys[order]), order
+
+def _apply_kernel(s, kernel, *args):
+    values, years, offsets, order = _panel_arrays(s)
+
+    out = np.empty(len(s))
+    out[order] = kernel(values, years, offsets, *args)
+
+    return pd.Series(out, index=s.index, name=s.name)
+
+def yoy(s, periods=1):
+    """ Year-over-year growth of a fy (or ticker, fy) indexed Series """
+    return _apply_kernel(s, grouped_yoy, periods)
+
+def cagr(s, num_years):
+    """ CAGR over num_years of a fy (or ticker, fy) indexed Series """
+    return _apply_kernel(s, grouped_cagr, num_years)
+
+def growth_streak(s):
+    """ Consecutive years of YoY growth of a fy (or ticker, fy) indexed Series """
+    return _apply_kernel(s, grouped_growth_streak).astype(np.int64)
+
 class MetricsMethodology(object):
 
     def __init__(self, bs, income, cfs=None):
@@ -244,22 +431,69 @@ class MetricsMethodology(object):
         self.metrics = None
 
 
+    # (attribs coloured red/green by sign, columns formatted as whole numbers, columns formatted as %)
+    # Used by report_quantitative and by the Excel export
+    pretty_columns = None
+
     def pretty(self,attribs,nums, pct):
 
         # https://stackoverflow.com/questions/43102734/format-a-number-with-commas-to-separate-thousands
+        # apply(axis=None) hands the whole subset over at once, rather than a Python call per cell
         
-        return self.metrics.style.applymap(negative_red,subset=attribs).format(dict.fromkeys(nums,"{:,.0f}") | dict.fromkeys(pct,"{:,.2%}"))
+        return self.metrics.style.apply(sign_css, axis=None, subset=attribs).format("{:,.0f}", subset=[c for c in nums if c in self.metrics.columns]).format("{:,.2%}", subset=[c for c in pct if c in self.metrics.columns])
+
+    def data_version(self):
+        """ Changes whenever the metrics change, column names included """
+        values = int(pd.util.hash_pandas_object(self.metrics, index=True).sum())
+        return hash((values, tuple(self.metrics.columns)))
+
+    def pretty_html(self, attribs=None, nums=None, pct=None):
+        """ Rendered HTML of pretty(); cached per (methodology, data version) so redisplaying is free """
+
+        if attribs is None:
+            attribs, nums, pct = self.pretty_columns
+
+        key = (self.name, self.data_version(), tuple(attribs), tuple(nums), tuple(pct))
+        if key in _pretty_html_cache:
+            _pretty_html_cache.move_to_end(key)
+        else:
+            _pretty_html_cache[key] = self.pretty(attribs, nums, pct).to_html()
+            # Least recently used goes first; a long running dashboard would otherwise keep every version forever
+            while len(_pretty_html_cache) > pretty_html_cache_size:
+                _pretty_html_cache.popitem(last=False)
+
+        return _pretty_html_cache[key]
 
     def write_spreadsheet(self, writer, sheetname):
-        self.metrics.to_excel(writer, sheet_name=sheetname)
-        self.report.to_excel(writer, sheet_name=sheetname,startrow=len(self.metrics)+4)
+        # writer: any pd.ExcelWriter, or an xlsxwriter Workbook. xlsxwriter gets the same streamed & styled sheet
+        # as write_spreadsheet() makes; other engines get plain to_excel in the same layout
+        workbook = report_export.xlsx_workbook(writer)
+        if workbook is None:
+            self.metrics.to_excel(writer, sheet_name=sheetname)
+            self.report.to_excel(writer, sheet_name=sheetname, startrow=len(self.metrics)+4)
+            return
+
+        report_export.write_methodology_sheet(workbook, sheetname, self.metrics, self.report, self.pretty_columns,
+                                              workbook.add_format({'bold': True}))
     
+pretty_html_cache_size = 256
+_pretty_html_cache = collections.OrderedDict()
+
 def negative_red(val):
     color = 'red' if val < 0 else 'green'
     return 'color: %s' % color
 
+def sign_css(df):
+    """ negative_red for a whole block at once, from one boolean sign mask """
+
+    negative = df.to_numpy(dtype=np.float64, na_value=np.nan) < 0
+    return pd.DataFrame(np.where(negative, 'color: red', 'color: green'), index=df.index, columns=df.columns)
+
 class Mizrahi(MetricsMethodology):
 
+    pretty_columns = (['Solvency_YoY','ROE_YoY', 'Sales_YoY','NPM_YoY', 'OperatingMargin_YoY','EPS_YoY', 'FCF_YoY','FCF_Margin_YoY'],
+                      ['Sales','FCF'],['FCF_Margin','OperatingMargin','ROE','NPM','ROE_YoY', 'Sales_YoY','NPM_YoY', 'OperatingMargin_YoY','EPS_YoY', 'FCF_YoY','FCF_Margin_YoY'])
+
     def __init__(self, bs, income, cfs):
         MetricsMethodology.__init__(self, bs, income, cfs)
 
@@ -288,28 +522,28 @@ class Mizrahi(MetricsMethodology):
 
 
         self.metrics['Sales'] = self.income.df.Revenues
-        self.metrics['Sales_YoY'] = self.metrics.Sales.pct_change(periods=1)
+        self.metrics['Sales_YoY'] = yoy(self.metrics.Sales)
 
         self.metrics['NPM'] = self.income.df.NetIncomeLoss / self.income.df.Revenues
-        self.metrics['NPM_YoY'] = self.metrics.NPM.pct_change(periods=1)
+        self.metrics['NPM_YoY'] = yoy(self.metrics.NPM)
         self.metrics['ROE'] = self.income.df.NetIncomeLoss / self.bs.df.StockholdersEquity
-        self.metrics['ROE_YoY'] = self.metrics.ROE.pct_change(periods=1)
+        self.metrics['ROE_YoY'] = yoy(self.metrics.ROE)
 
         self.metrics['OperatingMargin'] = self.income.df['OperatingIncomeLoss'] / self.metrics.Sales
-        self.metrics['OperatingMargin_YoY'] = self.metrics['OperatingMargin'].pct_change()
+        self.metrics['OperatingMargin_YoY'] = yoy(self.metrics['OperatingMargin'])
 
         self.metrics['EPS-DILUTED'] = self.income.df.EarningsPerShareDiluted
-        self.metrics['EPS_YoY'] = self.metrics['EPS-DILUTED'].pct_change()
+        self.metrics['EPS_YoY'] = yoy(self.metrics['EPS-DILUTED'])
 
         self.metrics['FCF'] = self.cfs.df['NetCashProvidedByUsedInOperatingActivities'] - self.cfs.df['PaymentsToAcquirePropertyPlantAndEquipment']
-        self.metrics['FCF_YoY'] = self.metrics['FCF'].pct_change()
+        self.metrics['FCF_YoY'] = yoy(self.metrics['FCF'])
 
         self.metrics['FCF_Margin'] = self.metrics['FCF'] / self.metrics['Sales']
-        self.metrics['FCF_Margin_YoY'] = self.metrics['FCF_Margin'].pct_change()
+        self.metrics['FCF_Margin_YoY'] = yoy(self.metrics['FCF_Margin'])
 
         self.metrics['CurrentRatio'] = self.bs.df['AssetsCurrent'] / self.bs.df['LiabilitiesCurrent']
         self.metrics['Solvency (D/E Ratio)'] = self.bs.df['LongTermDebtNoncurrent']/self.bs.df['StockholdersEquity']
-        self.metrics['Solvency_YoY'] = self.metrics['Solvency (D/E Ratio)'].pct_change()
+        self.metrics['Solvency_YoY'] = yoy(self.metrics['Solvency (D/E Ratio)'])
 
 
         conditions = [
@@ -398,14 +632,16 @@ class Mizrahi(MetricsMethodology):
 
 
     def report_quantitative(self):
-        return self.pretty(['Solvency_YoY','ROE_YoY', 'Sales_YoY','NPM_YoY', 'OperatingMargin_YoY','EPS_YoY', 'FCF_YoY','FCF_Margin_YoY'],
-                    ['Sales','FCF'],['FCF_Margin','OperatingMargin','ROE','NPM','ROE_YoY', 'Sales_YoY','NPM_YoY', 'OperatingMargin_YoY','EPS_YoY', 'FCF_YoY','FCF_Margin_YoY'])
+        return self.pretty(*self.pretty_columns)
 
     def write_spreadsheet(self, writer):
         MetricsMethodology.write_spreadsheet(self, writer, sheetname="Mizrahi")
 
 class Safal(MetricsMethodology):
 
+    pretty_columns = (['GrossProfit_YoY','Gross Margin_YoY','ROE_YoY'],
+                      ['MarketCap', 'P/E', 'GrossProfit'],['Gross Margin', 'GrossProfit_YoY', 'ROE', 'Gross Margin_YoY','ROE_YoY'])
+
     def __init__(self, bs, income, cfs):
         MetricsMethodology.__init__(self, bs, income, cfs)
 
@@ -414,11 +650,12 @@ class Safal(MetricsMethodology):
         self.name = 'Safal'
 
 
-    def get_market_metrics(self, ticker):
+    def get_market_metrics(self, ticker, quotes=None):
 
-
-        # Need code to grab current marketcap & P/E; use GoogleFinance
-        ticker_info = yf.Ticker(ticker).info
+        # quotes is a market_data.QuoteCache; the shared one is used by default so
+        # Safal & KJMarshall for the same ticker only fetch once
+        quotes = quotes if quotes is not None else md.get_quote_cache()
+        ticker_info = quotes.get_quote(ticker)
         
         # return [ticker_info['regularMarketPreviousClose'], 
                 # ticker_info['marketCap']]
@@ -440,13 +677,13 @@ class Safal(MetricsMethodology):
 
 
         self.metrics['GrossProfit'] = self.income.df['GrossProfit']
-        self.metrics['GrossProfit_YoY'] = self.income.df['GrossProfit'].pct_change()
+        self.metrics['GrossProfit_YoY'] = yoy(self.income.df['GrossProfit'])
 
         self.metrics['Gross Margin'] = self.income.df['GrossProfit'] / self.income.df.Revenues
-        self.metrics['Gross Margin_YoY'] = self.metrics['Gross Margin'].pct_change()
+        self.metrics['Gross Margin_YoY'] = yoy(self.metrics['Gross Margin'])
 
         self.metrics['ROE'] = self.income.df.NetIncomeLoss / self.bs.df.StockholdersEquity
-        self.metrics['ROE_YoY'] = self.metrics.ROE.pct_change(periods=1)
+        self.metrics['ROE_YoY'] = yoy(self.metrics.ROE)
 
         #self.metrics['P/E'] = self.pe
         #self.metrics['MarketCap'] = self.marketcap
@@ -498,8 +735,7 @@ class Safal(MetricsMethodology):
 
 
     def report_quantitative(self):
-        return self.pretty(['GrossProfit_YoY','Gross Margin_YoY','ROE_YoY'],
-                    ['MarketCap', 'P/E', 'GrossProfit'],['Gross Margin', 'GrossProfit_YoY', 'ROE', 'Gross Margin_YoY','ROE_YoY'])
+        return self.pretty(*self.pretty_columns)
 
     def write_spreadsheet(self, writer):
         MetricsMethodology.write_spreadsheet(self, writer, sheetname="Safal")
@@ -548,59 +784,59 @@ class ThreeBrians(MetricsMethodology):
 
         
         self.metrics['Solvency (D/E Ratio)'] = self.bs.df['LongTermDebtNoncurrent']/self.bs.df['StockholdersEquity']
-        self.metrics['Solvency_YoY'] = self.metrics['Solvency (D/E Ratio)'].pct_change()
+        self.metrics['Solvency_YoY'] = yoy(self.metrics['Solvency (D/E Ratio)'])
 
         self.metrics['Goodwill-to-Assets'] = self.bs.df['Goodwill'] / self.bs.df['Assets']
-        self.metrics['GtoA_YoY'] = self.metrics['Goodwill-to-Assets'].pct_change()
+        self.metrics['GtoA_YoY'] = yoy(self.metrics['Goodwill-to-Assets'])
 
         self.metrics['Cash'] = self.bs.df['CashAndCashEquivalentsAtCarryingValue']
 
         self.metrics['Intangibles'] = self.bs.df[['IndefiniteLivedTrademarks','OtherIndefiniteLivedAndFiniteLivedIntangibleAssets','Goodwill']].sum(axis=1)
 
-        self.metrics['Goodwill_YoY'] = self.bs.df['Goodwill'].pct_change()
+        self.metrics['Goodwill_YoY'] = yoy(self.bs.df['Goodwill'])
 
         self.metrics['Sales'] = self.income.df.Revenues
-        self.metrics['Sales_YoY'] = self.metrics.Sales.pct_change(periods=1)
+        self.metrics['Sales_YoY'] = yoy(self.metrics.Sales)
 
         self.metrics['GrossProfit'] = self.income.df['GrossProfit']
-        self.metrics['GrossProfit_YoY'] = self.income.df['GrossProfit'].pct_change()
+        self.metrics['GrossProfit_YoY'] = yoy(self.income.df['GrossProfit'])
 
         self.metrics['Gross Margin'] = self.income.df['GrossProfit'] / self.metrics.Sales
-        self.metrics['Gross Margin_YoY'] = self.metrics['Gross Margin'].pct_change()
+        self.metrics['Gross Margin_YoY'] = yoy(self.metrics['Gross Margin'])
 
         self.metrics['OperatingMargin'] = self.income.df['OperatingIncomeLoss'] / self.metrics.Sales
-        self.metrics['OperatingMargin_YoY'] = self.metrics['OperatingMargin'].pct_change()
+        self.metrics['OperatingMargin_YoY'] = yoy(self.metrics['OperatingMargin'])
 
         self.metrics['NPM'] = self.income.df.NetIncomeLoss / self.metrics.Sales
-        self.metrics['NPM_YoY'] = self.metrics.NPM.pct_change(periods=1)
+        self.metrics['NPM_YoY'] = yoy(self.metrics.NPM)
 
         
         self.metrics['EPS-DILUTED'] = self.income.df.EarningsPerShareDiluted
-        self.metrics['EPS_YoY'] = self.metrics['EPS-DILUTED'].pct_change()
+        self.metrics['EPS_YoY'] = yoy(self.metrics['EPS-DILUTED'])
 
         self.metrics['No. Shares Diluted'] = self.income.df.WeightedAverageNumberOfDilutedSharesOutstanding
-        self.metrics['SharesOutstanding_YoY'] = self.metrics['No. Shares Diluted'].pct_change()
+        self.metrics['SharesOutstanding_YoY'] = yoy(self.metrics['No. Shares Diluted'])
 
-        self.metrics['OperatingExpenses_YoY'] = self.income.df['OperatingExpenses'].pct_change()
+        self.metrics['OperatingExpenses_YoY'] = yoy(self.income.df['OperatingExpenses'])
 
         self.metrics['SGA%'] = self.income.df['SellingGeneralAndAdministrativeExpense'] / self.income.df['GrossProfit']
-        self.metrics['SGA%_YoY'] = self.metrics['SGA%'].pct_change()
+        self.metrics['SGA%_YoY'] = yoy(self.metrics['SGA%'])
 
         self.metrics['OperExpenses'] = self.income.df['OperatingExpenses'] / self.income.df['GrossProfit']
-        self.metrics['OperExpenses_YoY'] = self.metrics['OperExpenses'].pct_change()
+        self.metrics['OperExpenses_YoY'] = yoy(self.metrics['OperExpenses'])
 
         self.metrics['OperatingCashFlow'] = self.cfs.df['NetCashProvidedByUsedInOperatingActivities']
-        self.metrics['OperCashFlow_YoY'] = self.metrics['OperatingCashFlow'].pct_change()
+        self.metrics['OperCashFlow_YoY'] = yoy(self.metrics['OperatingCashFlow'])
         self.metrics['NetIncome'] = self.income.df.NetIncomeLoss
-        self.metrics['NetIncome_YoY'] = self.metrics['NetIncome'].pct_change()
+        self.metrics['NetIncome_YoY'] = yoy(self.metrics['NetIncome'])
         self.metrics['CapEx'] = self.cfs.df['PaymentsToAcquirePropertyPlantAndEquipment']
         self.metrics['FCF'] = self.cfs.df['NetCashProvidedByUsedInOperatingActivities'] - self.metrics['CapEx']
 
-        self.metrics['CapEx_YoY'] = self.metrics['CapEx'].pct_change()
-        self.metrics['FCF_YoY'] = self.metrics['FCF'].pct_change()
+        self.metrics['CapEx_YoY'] = yoy(self.metrics['CapEx'])
+        self.metrics['FCF_YoY'] = yoy(self.metrics['FCF'])
 
         self.metrics['FCF Margin'] = self.metrics['FCF'] / self.metrics['Sales']
-        self.metrics['FCF Margin_YoY'] = self.metrics['FCF Margin'].pct_change()
+        self.metrics['FCF Margin_YoY'] = yoy(self.metrics['FCF Margin'])
 
 
         # May include this back at some point but initially, it'll be too much noise
@@ -608,13 +844,13 @@ class ThreeBrians(MetricsMethodology):
 
 
         self.metrics['SBC%'] = self.cfs.df['ShareBasedCompensation'] / self.metrics.Sales
-        self.metrics['SBC_YoY'] = self.metrics['SBC%'].pct_change()
+        self.metrics['SBC_YoY'] = yoy(self.metrics['SBC%'])
 
         self.metrics['Depreciation'] = self.cfs.df['DepreciationDepletionAndAmortization']
 
         self.metrics['Equity'] = self.bs.df.StockholdersEquity
         self.metrics['ROE'] = self.income.df.NetIncomeLoss / self.metrics.Equity
-        self.metrics['ROE_YoY'] = self.metrics.ROE.pct_change(periods=1)
+        self.metrics['ROE_YoY'] = yoy(self.metrics.ROE)
         
         conditions = [
             [
@@ -826,6 +1062,10 @@ class ThreeBrians(MetricsMethodology):
 
 class Buffett(MetricsMethodology):
 
+    pretty_columns = (['EPS_YoY', 'RetainedYoY'],
+                      ['IncomeTaxManualCalc','ReportedTax','EBT','Inventory','RetainedEarnings','NetSharesBuyback'],
+                      ['GrossMargin','NPM','SGA','InterestExpense','DepreciationAmortizationExpense', 'NetReceivables','ROA', 'AdjDebtToEquityRatio','RetainedYoY', 'CapEx/NetIncome'])
+
     def __init__(self, bs, income, cfs):
         MetricsMethodology.__init__(self, bs, income, cfs)
         
@@ -861,7 +1101,7 @@ class Buffett(MetricsMethodology):
         self.metrics['IncomeTaxManualCalc'] = self.income.df['IncomeLossFromContinuingOperationsBeforeIncomeTaxesExtraordinaryItemsNoncontrollingInterest'] * .21
         self.metrics['ReportedTax'] = self.income.df['IncomeTaxExpenseBenefit']
         self.metrics['EPS-DILUTED'] = self.income.df.EarningsPerShareDiluted
-        self.metrics['EPS_YoY'] = self.metrics['EPS-DILUTED'].pct_change()
+        self.metrics['EPS_YoY'] = yoy(self.metrics['EPS-DILUTED'])
         self.metrics['EBT'] = self.income.df['IncomeLossFromContinuingOperationsBeforeIncomeTaxesExtraordinaryItemsNoncontrollingInterest']
         self.metrics['Inventory'] = self.bs.df['InventoryNet']
         self.metrics['NetIncome'] = self.income.df.NetIncomeLoss
@@ -870,7 +1110,7 @@ class Buffett(MetricsMethodology):
         self.metrics['YearsofNItoPayLTD'] = np.ceil(self.bs.df['LongTermDebtNoncurrent'] / self.income.df.NetIncomeLoss)
         self.metrics['AdjDebtToEquityRatio'] = self.bs.df['LongTermDebtNoncurrent']/(self.bs.df['TreasuryStockValue']+self.bs.df['StockholdersEquity'])
         self.metrics['RetainedEarnings'] = self.bs.df['RetainedEarningsAccumulatedDeficit']
-        self.metrics['RetainedYoY'] = self.metrics['RetainedEarnings'].pct_change()
+        self.metrics['RetainedYoY'] = yoy(self.metrics['RetainedEarnings'])
         self.metrics['CapEx/NetIncome'] = self.cfs.df['PaymentsToAcquirePropertyPlantAndEquipment']/self.income.df.NetIncomeLoss
         self.metrics['NetSharesBuyback'] = self.cfs.df['PaymentsForRepurchaseOfCommonStock'] - self.cfs.df['ProceedsFromIssuanceOfCommonStock']
 
@@ -990,9 +1230,7 @@ class Buffett(MetricsMethodology):
         return self.report
     
     def report_quantitative(self):
-        return self.pretty(['EPS_YoY', 'RetainedYoY'],
-                    ['IncomeTaxManualCalc','ReportedTax','EBT','Inventory','RetainedEarnings','NetSharesBuyback'],
-                    ['GrossMargin','NPM','SGA','InterestExpense','DepreciationAmortizationExpense', 'NetReceivables','ROA', 'AdjDebtToEquityRatio','RetainedYoY', 'CapEx/NetIncome'])
+        return self.pretty(*self.pretty_columns)
     
     def write_spreadsheet(self, writer):
         MetricsMethodology.write_spreadsheet(self, writer, sheetname="Buffett")
@@ -1073,11 +1311,12 @@ class KJMarshall(MetricsMethodology):
 
         return self.report
 
-    def get_market_metrics(self, ticker):
-
+    def get_market_metrics(self, ticker, quotes=None):
 
-        # Need code to grab current marketcap & P/E; use GoogleFinance
-        ticker_info = yf.Ticker(ticker).info
+        # quotes is a market_data.QuoteCache; the shared one is used by default so
+        # Safal & KJMarshall for the same ticker only fetch once
+        quotes = quotes if quotes is not None else md.get_quote_cache()
+        ticker_info = quotes.get_quote(ticker)
         
         # return [ticker_info['regularMarketPreviousClose'], 
                 # ticker_info['marketCap']]
@@ -1099,42 +1338,237 @@ class KJMarshall(MetricsMethodology):
 def gather_columns(df, txt):
     return df.filter(regex=txt)
 
-def create_common_metrics(*methods):
+common_metric_keys = ['Sales', 'Gross','CurrentRatio', 'Solvency', 'NPM', 'ROE', 'OperatingMargin', 'SGA','EPS', 'FCF']
+
+def drop_duplicate_columns(df):
+    """
+    Drop columns whose contents duplicate an earlier column, regardless of name.
+    Same result as df.T.drop_duplicates().T but without the transpose, so dtypes survive.
+    Like the transpose, numbers are compared by value whatever their dtype (an int64 2 duplicates a float64 2.0)
+    """
+
+    kept = {}
+    keep = []
+
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+
+        if pd.api.types.is_numeric_dtype(col.dtype):
+            # As float64, with -0.0 & every NaN normalised, the raw bytes are equal exactly when the values are
+            values = col.to_numpy(dtype=np.float64, na_value=np.nan) + 0.0
+            values[np.isnan(values)] = np.nan
+            key = ('number', values.tobytes())
+            if key in kept:
+                continue
+            kept[key] = [i]
+        else:
+            # hash_pandas_object gives one uint64 per row; the bytes of that array act as the column's fingerprint
+            key = ('object', pd.util.hash_pandas_object(col, index=False).to_numpy().tobytes())
+
+            # Fingerprint collisions are confirmed against the real values before a column is dropped
+            if any(col.equals(df.iloc[:, j]) for j in kept.get(key, [])):
+                continue
+            kept.setdefault(key, []).append(i)
 
-    df_common = pd.DataFrame()
+        keep.append(i)
 
-    for s in ['Sales', 'Gross','CurrentRatio', 'Solvency', 'NPM', 'ROE', 'OperatingMargin', 'SGA','EPS', 'FCF']:
+    return df.iloc[:, keep]
+
+def _build_common_metrics(frames):
+    """ frames is a list of (name, metrics, report) tuples; see create_common_metrics """
+
+    pieces = []
+
+    for s in common_metric_keys:
 
         # Gather metrics
-        for m in methods:
-            # df_common = pd.concat([df_common, gather_columns(m.metrics, s)], axis="columns").T.drop_duplicates().T
-            df_common = pd.concat([df_common, gather_columns(m.metrics, s)], axis="columns")
+        for name, metrics, report in frames:
+            pieces.append(gather_columns(metrics, s))
 
         # Now gather commentary
-        for m in methods:
-            ret_df = gather_columns(m.report, s)
+        for name, metrics, report in frames:
+            ret_df = gather_columns(report, s)
             # Nice trick to append to colnames
             # https://stackoverflow.com/questions/34049618/how-to-add-a-suffix-or-prefix-to-each-column-name
-            ret_df.columns = [str(col) + '-' + m.name for col in ret_df.columns]
+            ret_df.columns = [str(col) + '-' + name for col in ret_df.columns]
 
-            df_common = pd.concat([df_common,ret_df],axis="columns")
+            pieces.append(ret_df)
 
-    # Below trick to get rid of dupe columns from: https://sparkbyexamples.com/pandas/pandas-remove-duplicate-columns-from-dataframe/#:~:text=To%20drop%20duplicate%20columns%20from%20pandas%20DataFrame%20use%20df.,data%20regardless%20of%20column%20names.
+    # Single concat at the end; concatenating inside the loop copies the growing frame every time
+    df_common = pd.concat(pieces, axis="columns")
 
-    return df_common.T.drop_duplicates().T
+    return drop_duplicate_columns(df_common)
 
-    
-def write_spreadsheet(fname, common_df, *methods): #, mizrahi, threebrians):
-    with pd.ExcelWriter(fname) as writer:
+def create_common_metrics(*methods):
+
+    return _build_common_metrics([(m.name, m.metrics, m.report) for m in methods])
+
+def create_common_metrics_universe(methods_by_ticker):
+    """
+    Build the common metrics view for many tickers at once.
+    methods_by_ticker maps ticker -> list of methodologies (same ones as passed to create_common_metrics)
+    Returns a frame indexed by (ticker, fy)
+    """
+
+    # Stack each methodology's frames across tickers so the gather and dedup only run once
+    stacked = {}
+    for ticker, methods in methods_by_ticker.items():
+        for m in methods:
+            metrics, reports = stacked.setdefault(m.name, ({}, {}))
+            metrics[ticker] = m.metrics
+            reports[ticker] = m.report
+
+    frames = [(name, pd.concat(metrics, names=['ticker']), pd.concat(reports, names=['ticker']))
+              for name, (metrics, reports) in stacked.items()]
 
-        common_df.to_excel(writer, sheet_name='Common')
-   
+    return _build_common_metrics(frames)
+
+    
+def analyze_ticker(facts, ticker, starting_year=2014, offset_fy=0, drop_tags=()):
+    """
+    The notebook flow in one call: statements, then every methodology's report_qualitative.
+    drop_tags are removed up front for companies whose tag alternates clash, e.g. KO needs
+    FiniteLivedIntangibleAssetsNet & InventoryFinishedGoodsNetOfReserves dropped
+    Returns (common_df, methods) ready for write_spreadsheet(fname, common_df, *methods)
+    """
+
+    facts = facts[~facts.tag.isin(list(drop_tags))]
+
+    bs = BalanceSheet(facts, ticker, offset_fy, starting_year)
+    income = IncomeStatement(facts, starting_year)
+    cfs = CashFlowStatement(facts, starting_year)
+
+    methods = [Mizrahi(bs, income, cfs), Safal(bs, income, cfs), Buffett(bs, income, cfs), ThreeBrians(bs, income, cfs)]
+    for m in methods:
+        m.report_qualitative()
+
+    kjmarshall = KJMarshall(ticker, bs, income, cfs)
+    kjmarshall.report_qualitative()
+
+    # KJMarshall isn't part of the common view, same as in the notebooks
+    return create_common_metrics(*methods), [kjmarshall] + methods
+
+def shareholder_payout_per_share(cfs, income):
+    """
+    (buybacks + dividends) / diluted shares by fy, i.e. d_per_share for money_machine.calcJBWFromShareholderYield.
+    cfs needs the dividend tags: CashFlowStatement(facts, starting_year, extra_attribs=dividend_tags)
+    Missing buybacks or dividends count as 0; a year without diluted shares is NaN.
+    This is dollars per share, not a yield on price; valuation.valuation_series has that ratio as ShareholderYield
+    """
+
+    dividends = cfs.df.reindex(columns=dividend_tags).bfill(axis=1).iloc[:, 0]
+    buybacks = cfs.df['PaymentsForRepurchaseOfCommonStock']
+    shares = income.df['WeightedAverageNumberOfDilutedSharesOutstanding']
+
+    df = pd.DataFrame({'Buybacks': buybacks, 'Dividends': dividends}).reindex(shares.index.union(cfs.df.index))
+    df['DilutedShares'] = shares
+    df['ShareholderPayoutPerShare'] = (df['Buybacks'].fillna(0) + df['Dividends'].fillna(0)) / df['DilutedShares']
+
+    return df
+
+def shareholder_payout_universe(facts_by_ticker, starting_year=2014):
+    """
+    shareholder_payout_per_share for every ticker. facts_by_ticker: {ticker: facts} or an iterable of
+    (ticker, facts) pairs, e.g. ((t, store.load_facts(t)) for t in store.tickers()) to keep
+    only one filer's facts in memory at a time
+    Returns a (ticker, fy) frame; latest_shareholder_payout picks each ticker's last year
+    """
+
+    items = facts_by_ticker.items() if hasattr(facts_by_ticker, 'items') else facts_by_ticker
+
+    frames = {}
+    for ticker, facts in items:
+        try:
+            cfs = CashFlowStatement(facts, starting_year, extra_attribs=dividend_tags)
+            income = IncomeStatement(facts, starting_year)
+            frames[ticker] = shareholder_payout_per_share(cfs, income)
+        except (ValueError, KeyError) as e:
+            print("WARN: Skipping " + ticker + ": " + str(e))
+
+    if not frames:
+        index = pd.MultiIndex.from_arrays([[], []], names=['ticker', 'fy'])
+        return pd.DataFrame(columns=['Buybacks', 'Dividends', 'DilutedShares', 'ShareholderPayoutPerShare'],
+                            index=index, dtype=float)
+
+    return pd.concat(frames, names=['ticker', 'fy'])
+
+def latest_shareholder_payout(panel):
+    """ ticker -> latest year's shareholder payout per share; goes straight into calcJBWSensitivity """
+
+    panel = panel.dropna(subset=['ShareholderPayoutPerShare'])
+    return panel.groupby(level='ticker')['ShareholderPayoutPerShare'].last()
+
+def stack_methodology_metrics(methods_by_ticker):
+    """
+    Long panel of every numeric methodology metric across a universe.
+    methods_by_ticker maps ticker -> list of methodologies (after report_qualitative has run)
+    Columns: ticker, fy, methodology, metric, value
+    """
+
+    stacked = {}
+    for ticker, methods in methods_by_ticker.items():
         for m in methods:
-            m.write_spreadsheet(writer)
+            stacked.setdefault(m.name, {})[ticker] = m.metrics.select_dtypes('number')
+
+    panel = []
+    for name, metrics in stacked.items():
+        df = pd.concat(metrics, names=['ticker'])
+        df.index = df.index.set_names(['ticker', 'fy'])
+        df.columns.name = 'metric'
+
+        long_df = df.stack().rename('value').reset_index()
+        long_df.insert(2, 'methodology', name)
+        panel.append(long_df)
+
+    panel = pd.concat(panel, ignore_index=True)
+    # inf shows up for growth off a 0 base; it would swamp the z-scores
+    panel['value'] = panel['value'].replace([np.inf, -np.inf], np.nan)
+
+    return panel
 
-        # buffett.write_spreadsheet(writer)
-        # data_frame2.to_excel(writer, sheet_name="Vegetables", index=False)
-        # data_frame3.to_excel(writer, sheet_name="Baked Items", index=False)
+def _rank_within(panel, keys, suffix):
+    g = panel.groupby(keys, sort=False, dropna=False)['value']
 
+    panel['pct_rank' + suffix] = g.rank(pct=True)
+    panel['zscore' + suffix] = (panel['value'] - g.transform('mean')) / g.transform('std')
 
-   
+def rank_universe(methods_by_ticker, peer_groups=None):
+    """
+    Per-year percentile rank (1.0 = highest value) and z-score of every methodology metric,
+    across the whole universe and, if peer_groups (ticker -> group, e.g. from get_sic_codes) is
+    given, within each peer group too.
+    Note ranks are by value only; for metrics like Solvency lower is better
+    """
+
+    panel = stack_methodology_metrics(methods_by_ticker)
+    keys = ['fy', 'methodology', 'metric']
+
+    _rank_within(panel, keys, '')
+
+    if peer_groups is not None:
+        panel['peer_group'] = panel['ticker'].map(peer_groups)
+        _rank_within(panel, keys + ['peer_group'], '_peer')
+
+    return panel
+
+def write_spreadsheet(fname, common_df, *methods): #, mizrahi, threebrians):
+    # Streams rows straight to disk; see report_export. Each methodology gets a sheet named after it,
+    # same layout as MetricsMethodology.write_spreadsheet
+    return report_export.write_report_workbook(fname, common_df, report_export.methodology_frames(methods),
+                                               report_export.methodology_styles(methods))
+
+def write_universe_spreadsheets(reports, out_dir, max_workers=None):
+    """ One xlsx per ticker in parallel worker processes; reports maps ticker -> (common_df, methods) """
+    return report_export.write_universe_workbooks(reports, out_dir, max_workers)
+
+def _methods_ticker(methods):
+    # BalanceSheet is the one statement that's told its ticker
+    return methods[0].bs.ticker if methods else None
+
+def write_columnar(fname, fmt, common_df, *methods, ticker=None):
+    """
+    Same content as write_spreadsheet, as one long (ticker, fy, methodology, metric) table.
+    fmt: 'parquet', 'feather' or 'arrow' (Arrow IPC); report_export.read_columnar loads it back
+    """
+    df = report_export.long_format(report_export.methodology_frames(methods), common_df, ticker or _methods_ticker(methods))
+    return report_export.write_columnar(df, fname, fmt)
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+import edgar_utils as eu
+
+# Local, on-disk copy of everything pulled from EDGAR, so reports can be rebuilt offline.
+# Layout under root:
+#   facts/<TICKER>.parquet          companyfacts frame from get_json_financials_from_tikr
+#   profiles/<TICKER>.json          name & SIC from get_company_profile, fetched along with the facts
+#   <kind>/<TICKER>.parquet         derived frames (statements, metrics, reports) by kind
+
+
+class FactStore(object):
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'facts'), exist_ok=True)
+
+    def path(self, kind, ticker):
+        return os.path.join(self.root, kind, ticker + '.parquet')
+
+    def tickers(self):
+        """ Tickers with facts on disk """
+        return sorted(f[:-len('.parquet')] for f in os.listdir(os.path.join(self.root, 'facts')) if f.endswith('.parquet'))
+
+    def has_facts(self, ticker):
+        return os.path.exists(self.path('facts', ticker))
+
+    def save_facts(self, ticker, facts):
+        facts.to_parquet(self.path('facts', ticker), index=False)
+
+    def load_facts(self, ticker):
+        return pd.read_parquet(self.path('facts', ticker))
+
+    def fetch_facts(self, ticker, refresh=False):
+        """ Facts from disk, only going to EDGAR if they're not there yet (or refresh=True) """
+
+        if refresh or not self.has_facts(ticker):
+            self.save_facts(ticker, eu.get_json_financials_from_tikr(ticker))
+            self.save_profile(ticker, eu.get_company_profile(ticker))
+
+        return self.load_facts(ticker)
+
+    def save_profile(self, ticker, profile):
+        os.makedirs(os.path.join(self.root, 'profiles'), exist_ok=True)
+        with open(os.path.join(self.root, 'profiles', ticker + '.json'), 'w') as f:
+            json.dump(profile, f)
+
+    def load_profile(self, ticker):
+        """ The stored name & SIC; {} if the facts predate profiles """
+
+        path = os.path.join(self.root, 'profiles', ticker + '.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def facts_version(self, ticker):
+        """ Content hash of the stored facts; changes only when a re-fetch brought new data """
+
+        digest = hashlib.sha1()
+        with open(self.path('facts', ticker), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def save_frame(self, ticker, kind, df):
+        os.makedirs(os.path.join(self.root, kind), exist_ok=True)
+        df.to_parquet(self.path(kind, ticker))
+
+    def load_frame(self, ticker, kind):
+        return pd.read_parquet(self.path(kind, ticker))
+
+    def has_frame(self, ticker, kind):
+        return os.path.exists(self.path(kind, ticker))
@@ -0,0 +1,171 @@
+import base64
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import re
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Every outside call (SEC, multpl, Shiller, yfinance) goes through the current transport, so the
+# same code runs live, records what it fetched, or replays it offline.
+#   live     straight to the network (the default)
+#   record   to the network, and each response is saved as a gzip JSON cassette
+#   replay   only from cassettes; a call with no cassette raises MissingCassette
+# The mode & cassette folder can come from STOCKS_HTTP_MODE / STOCKS_CASSETTES, or be set in code
+# with set_transport / use_cassettes.
+
+cassette_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'cassettes')
+
+
+class MissingCassette(LookupError):
+    pass
+
+
+class Response(object):
+
+    """ The bits of requests.Response the callers use; what a cassette stores """
+
+    def __init__(self, url, status_code, content, headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError('%d error for %s' % (self.status_code, self.url))
+
+
+class LiveTransport(object):
+
+    mode = 'live'
+
+    def get(self, url, headers=None):
+        response = requests.get(url, headers=headers)
+        return Response(url, response.status_code, response.content, dict(response.headers))
+
+    def call(self, key, fn):
+        """ Non-HTTP calls (e.g. yfinance .info) keyed like a url; fn() must return JSON-able data """
+        return fn()
+
+
+def cassette_path(root, key):
+    """ Readable & unique: the url squashed to a slug, plus a hash of the whole thing """
+
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', key.split('://', 1)[-1]).strip('-')[:80]
+    return os.path.join(root, slug + '-' + hashlib.sha1(key.encode()).hexdigest()[:12] + '.json.gz')
+
+
+class RecordingTransport(LiveTransport):
+
+    mode = 'record'
+
+    def __init__(self, root=cassette_dir):
+        self.root = root
+
+    def _save(self, key, entry):
+        os.makedirs(self.root, exist_ok=True)
+        with gzip.open(cassette_path(self.root, key), 'wt') as f:
+            json.dump(dict(entry, key=key), f, default=str)
+
+    def get(self, url, headers=None):
+        # Validators aren't sent, so a replay never has to produce a 304 for a file it doesn't have
+        headers = {k: v for k, v in (headers or {}).items() if k not in ('If-None-Match', 'If-Modified-Since')}
+        response = LiveTransport.get(self, url, headers)
+
+        self._save(url, {'status_code': response.status_code, 'headers': dict(response.headers),
+                         'body': base64.b64encode(response.content).decode('ascii')})
+        return response
+
+    def call(self, key, fn):
+        result = fn()
+        self._save(key, {'result': result})
+        return result
+
+
+class ReplayTransport(object):
+
+    mode = 'replay'
+
+    def __init__(self, root=cassette_dir):
+        self.root = root
+
+    def _load(self, key):
+        path = cassette_path(self.root, key)
+        if not os.path.exists(path):
+            raise MissingCassette('No cassette for ' + key + ' (expected ' + path + '); '
+                                  'run once with STOCKS_HTTP_MODE=record to record it')
+
+        with gzip.open(path, 'rt') as f:
+            return json.load(f)
+
+    def get(self, url, headers=None):
+        entry = self._load(url)
+        return Response(url, entry['status_code'], base64.b64decode(entry['body']), entry['headers'])
+
+    def call(self, key, fn):
+        return self._load(key)['result']
+
+
+def rewrite_cassette(key, fn, root=None):
+    """ Replace a recorded response body with fn(body), e.g. to trim a large JSON response for the repo """
+
+    root = root or os.environ.get('STOCKS_CASSETTES') or cassette_dir
+    entry = ReplayTransport(root)._load(key)
+    body = fn(base64.b64decode(entry['body']))
+    RecordingTransport(root)._save(key, dict(entry, body=base64.b64encode(body).decode('ascii')))
+
+
+transports = {'live': LiveTransport, 'record': RecordingTransport, 'replay': ReplayTransport}
+
+def make_transport(mode, root=None):
+    if mode not in transports:
+        raise ValueError("mode should be 'live', 'record' or 'replay'")
+    if mode == 'live':
+        return LiveTransport()
+    return transports[mode](root or cassette_dir)
+
+
+_transport = None
+
+def get_transport():
+    """ Shared transport; starts out from STOCKS_HTTP_MODE (live if unset) & STOCKS_CASSETTES """
+    global _transport
+    if _transport is None:
+        _transport = make_transport(os.environ.get('STOCKS_HTTP_MODE', 'live'), os.environ.get('STOCKS_CASSETTES'))
+    return _transport
+
+def set_transport(transport):
+    global _transport
+    _transport = transport
+
+@contextlib.contextmanager
+def use_cassettes(mode=None, root=None):
+    """
+    Run a block against cassettes: mode defaults to STOCKS_HTTP_MODE, or replay if that's unset
+    (so tests are offline unless asked to record)
+    """
+
+    previous = _transport
+    set_transport(make_transport(mode or os.environ.get('STOCKS_HTTP_MODE', 'replay'),
+                                 root or os.environ.get('STOCKS_CASSETTES')))
+    try:
+        yield get_transport()
+    finally:
+        set_transport(previous)
+
+def get(url, headers=None):
+    return get_transport().get(url, headers)
+
+def call(key, fn):
+    return get_transport().call(key, fn)
@@ -0,0 +1,436 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import http_transport as transport
+
+# Loaders for the market-wide monthly series used by money_machine.
+# Every multpl.com series is the same "Date | Value" table, so they're described once in
+# multpl_series and fetched/parsed by the same code. Parsed series are cached on disk.
+
+multpl_url = 'https://www.multpl.com/{path}/table/by-month'
+
+# name -> page on multpl.com and what to multiply the printed number by
+# (percentages come back as fractions, same as the original DivYield/TsyYield columns).
+# multpl's Shiller PE is CAPE_multpl so it sits next to Shiller's own CAPE instead of colliding with it
+multpl_series = {'PE':            {'path': 's-p-500-pe-ratio',       'scale': 1.0},
+                 'DivYield':      {'path': 's-p-500-dividend-yield', 'scale': .01},
+                 'TsyYield':      {'path': '10-year-treasury-rate',  'scale': .01},
+                 'CAPE_multpl':   {'path': 'shiller-pe',             'scale': 1.0},
+                 'EarningsYield': {'path': 's-p-500-earnings-yield', 'scale': .01}}
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+http_headers = {'User-Agent': 'Mozilla/5.0 (jupyter_notebooks)'}
+
+
+def fetch_text(url):
+    response = transport.get(url, headers=http_headers)
+    response.raise_for_status()
+    return response.text
+
+def parse_multpl_table(html_text, name, scale=1.0):
+    """ Monthly Series (DatetimeIndex) from a multpl.com by-month table page """
+
+    # From: https://stackoverflow.com/questions/6325216/parse-html-table-to-python-list
+    table = pd.read_html(io.StringIO(html_text))[0] # Select table of interest
+
+    dates = pd.to_datetime(table['Date'])
+    # Values look like '4.12%' or '28.53' possibly with an estimate marker; keep just the number
+    values = table.iloc[:, 1].astype(str).str.extract(r'(-?\d+(?:\.\d+)?)', expand=False).astype(float) * scale
+
+    s = pd.Series(values.to_numpy(), index=pd.DatetimeIndex(dates, name='Date'), name=name)
+
+    return s.iloc[1:] # drop 1st row; it's the current month's running estimate
+
+def trim_multpl_page(html_text, since):
+    """
+    Just the by-month table of a multpl.com page: the header row and every month from since on
+    (the current month's estimate included), rows kept exactly as served. For test fixtures
+    """
+
+    since = pd.Timestamp(since)
+    keep = []
+    for row in re.findall(r'<tr[^>]*>.*?</tr>', html_text, flags=re.S):
+        date = re.search(r'<td[^>]*>(.*?)</td>', row, flags=re.S)
+        if date is None or pd.Timestamp(date.group(1).strip()) >= since:
+            keep.append(row)
+
+    return '<table id="datatable">\n' + '\n'.join(keep) + '\n</table>\n'
+
+def record_multpl_fixtures(out_dir, since='2000-01-01', names=None):
+    """ Fetch multpl pages and save them trimmed to out_dir/<page>.html, e.g. fixtures/multpl """
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in names or multpl_series:
+        url = multpl_url.format(path=multpl_series[name]['path'])
+        page = trim_multpl_page(fetch_text(url), since)
+
+        with open(os.path.join(out_dir, multpl_series[name]['path'] + '.html'), 'w') as f:
+            f.write('<!-- %s captured %s, months before %s trimmed -->\n' % (url, datetime.date.today(), since) + page)
+
+
+class MultplLoader(object):
+
+    def __init__(self, cache_dir=cache_dir, ttl=24 * 60 * 60, offline=False, fetch=fetch_text, max_workers=4):
+        """
+        ttl: seconds before a cached series is fetched again
+        offline: only use the cache, whatever its age
+        fetch: url -> html text; swap for a function reading saved pages in tests
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.fetch = fetch
+        self.max_workers = max_workers
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, 'multpl-' + name + '.parquet')
+
+    def _cached(self, name):
+        """ Cached series, or None if missing (or stale when online) """
+
+        path = self.cache_path(name)
+        if not os.path.exists(path):
+            return None
+        if not self.offline and time.time() - os.path.getmtime(path) > self.ttl:
+            return None
+
+        return pd.read_parquet(path)[name]
+
+    def _download(self, name):
+        spec = multpl_series[name]
+        s = parse_multpl_table(self.fetch(multpl_url.format(path=spec['path'])), name, spec['scale'])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        s.to_frame().to_parquet(self.cache_path(name))
+
+        return s
+
+    def load(self, names=('PE', 'DivYield', 'TsyYield')):
+        """ {name: Series} for the requested series; whatever isn't cached is fetched concurrently """
+
+        series = {name: self._cached(name) for name in names}
+        missing = [name for name, s in series.items() if s is None]
+
+        if missing and self.offline:
+            raise ValueError('Offline and no cached multpl data for: ' + ', '.join(missing))
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+                for name, s in zip(missing, ex.map(self._download, missing)):
+                    series[name] = s
+
+        return series
+
+
+def month_year_index(dates):
+    """ The 'M-YYYY' string labels money_machine tables have used, e.g. '3-2000' """
+    return dates.month.astype(str) + '-' + dates.year.astype(str)
+
+
+# Robert Shiller's monthly S&P data. The workbook is several MB and read_excel takes seconds,
+# so the raw file is kept with its ETag/Last-Modified (later fetches are conditional GETs that
+# usually come back 304) and the parsed frame is kept as a parquet snapshot that loads in ms.
+
+shiller_url = 'http://www.econ.yale.edu/~shiller/data/ie_data.xls'
+
+shiller_names = ['date', 's&p comp price', 's&p comp div', 's&p comp earnings', 'CPI', 'date fraction',
+                 'int rate GS10', 'real price', 'real div', 'real total ret price', 'real earnings',
+                 'real tr scaled earnings', 'CAPE']
+
+def fetch_response(url, headers=None):
+    return transport.get(url, headers=dict(http_headers, **(headers or {})))
+
+def parse_shiller_workbook(content):
+    """
+    Typed frame from the ie_data workbook bytes: DatetimeIndex 'date' (first of the month), floats.
+    Rather than trusting skipfooter or a fixed row count, any row whose date isn't a number
+    (the header block, notes & footer) is dropped
+    """
+
+    raw = pd.read_excel(io.BytesIO(content), sheet_name='Data', skiprows=8, usecols='A:M',
+                        names=shiller_names, header=None)
+
+    years = pd.to_numeric(raw['date'], errors='coerce')
+    df = raw[years.notna()].drop(columns='date')
+    df = df.apply(pd.to_numeric, errors='coerce').astype(float)
+
+    # 2016.1 is October; shiller_months reads the number the same way
+    df.index = pd.DatetimeIndex(shiller_months(years[years.notna()]).to_timestamp(), name='date', freq=None)
+
+    return df[~df.index.duplicated()]
+
+
+class ShillerLoader(object):
+
+    def __init__(self, cache_dir=cache_dir, ttl=24 * 60 * 60, offline=False, fetch=fetch_response, url=shiller_url):
+        """
+        ttl: seconds before the server is asked again whether the workbook changed
+        offline: only use the cache, whatever its age
+        fetch: (url, headers) -> response with status_code, headers and content
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.fetch = fetch
+        self.url = url
+
+    def cache_path(self, ext):
+        return os.path.join(self.cache_dir, 'shiller-ie_data.' + ext)
+
+    def _meta(self):
+        path = self.cache_path('json')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_meta(self, meta):
+        with open(self.cache_path('json'), 'w') as f:
+            json.dump(meta, f)
+
+    def _snapshot(self):
+        if os.path.exists(self.cache_path('parquet')):
+            return pd.read_parquet(self.cache_path('parquet'))
+        if os.path.exists(self.cache_path('xls')):
+            return self._parse_raw()
+        return None
+
+    def _parse_raw(self):
+        with open(self.cache_path('xls'), 'rb') as f:
+            df = parse_shiller_workbook(f.read())
+        df.to_parquet(self.cache_path('parquet'))
+        return df
+
+    def load(self):
+        meta = self._meta()
+        fresh = time.time() - meta.get('checked', 0) <= self.ttl
+
+        if self.offline or fresh:
+            df = self._snapshot()
+            if df is not None:
+                return df
+            if self.offline:
+                raise ValueError('Offline and no cached Shiller data in ' + self.cache_dir)
+
+        have_raw = os.path.exists(self.cache_path('xls'))
+        headers = {}
+        if have_raw and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if have_raw and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self.fetch(self.url, headers)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        if response.status_code == 304 and have_raw:
+            meta['checked'] = time.time()
+            self._save_meta(meta)
+            return self._snapshot()
+
+        if response.status_code != 200:
+            raise ValueError('Fetching %s failed with HTTP %d' % (self.url, response.status_code))
+
+        with open(self.cache_path('xls'), 'wb') as f:
+            f.write(response.content)
+        self._save_meta({'etag': response.headers.get('ETag'),
+                         'last_modified': response.headers.get('Last-Modified'),
+                         'checked': time.time()})
+
+        return self._parse_raw()
+
+
+# Shiller ie_data.xls column -> macro frame column. GS10 stays in percent as Shiller prints it
+shiller_columns = {'s&p comp price': 'Price',
+                   's&p comp div': 'Dividend',
+                   's&p comp earnings': 'Earnings',
+                   'CPI': 'CPI',
+                   'int rate GS10': 'GS10',
+                   'real price': 'RealPrice',
+                   'real div': 'RealDividend',
+                   'real total ret price': 'RealTotalReturnPrice',
+                   'real earnings': 'RealEarnings',
+                   'CAPE': 'CAPE'}
+
+def shiller_months(dates):
+    """
+    Monthly PeriodIndex from Shiller's year.month dates (2016.08 = Aug 2016).
+    Goes via the number, so October's 2016.1 isn't mistaken for January
+    """
+
+    dates = pd.to_numeric(pd.Series(dates), errors='coerce').to_numpy()
+    years = dates.astype(int)
+    months = ((dates - years) * 100).round().astype(int)
+
+    labels = pd.Series(years).astype(str) + '-' + pd.Series(months).astype(str).str.zfill(2)
+    return pd.PeriodIndex(labels, freq='M', name='month')
+
+def multpl_monthly(multpl):
+    """ {name: Series} from MultplLoader.load as one PeriodIndex frame """
+
+    parts = []
+    for name, s in multpl.items():
+        s = s.copy()
+        s.index = s.index.to_period('M').rename('month')
+        parts.append(s[~s.index.duplicated()])
+
+    return pd.concat(parts, axis=1).sort_index()
+
+def shiller_monthly(shiller):
+    """ Shiller frame (typed or str-indexed) as a PeriodIndex frame with shiller_columns names """
+
+    sh = shiller.dropna(how='all')
+    if isinstance(sh.index, pd.DatetimeIndex):
+        months = sh.index.to_period('M').rename('month')
+    else:
+        # str-of-float dates as get_data_from_shiller used to return
+        sh = sh[pd.to_numeric(pd.Series(sh.index, index=sh.index), errors='coerce').notna()]
+        months = shiller_months(sh.index)
+    sh = sh.rename(columns=shiller_columns)[list(shiller_columns.values())].apply(pd.to_numeric, errors='coerce')
+    sh.index = months
+
+    return sh[~sh.index.duplicated()].sort_index()
+
+def _all_months(frame):
+    return frame.reindex(pd.period_range(frame.index.min(), frame.index.max(), freq='M', name='month'))
+
+def build_macro_frame(multpl, shiller=None):
+    """
+    One monthly frame (PeriodIndex 'month', oldest first) from multpl series & the Shiller data.
+    multpl: {name: Series} as from MultplLoader.load
+    shiller: frame as from ShillerLoader.load / money_machine.get_data_from_shiller (optional)
+    Every month between the first and last one any source has is present; gaps are NaN
+    """
+
+    parts = [multpl_monthly(multpl)]
+    if shiller is not None:
+        parts.append(shiller_monthly(shiller))
+
+    return _all_months(pd.concat(parts, axis=1).sort_index())
+
+
+class MacroStore(object):
+
+    """
+    The macro frame kept on disk and grown a month at a time.
+    macro.parquet holds the values; per month and series, provenance.parquet has the source the
+    number came from ('multpl', 'shiller') and stored.parquet when it was written (None/NaT where
+    no source has published it yet). An update only touches the cells a source has added or revised
+    since, so a series that lags its siblings is filled in when it catches up, and Shiller's
+    preliminary latest months are replaced once he revises them.
+    """
+
+    def __init__(self, root=os.path.join(cache_dir, 'macro')):
+        self.root = root
+
+    def path(self, name):
+        return os.path.join(self.root, name + '.parquet')
+
+    def _read(self, name):
+        if not os.path.exists(self.path(name)):
+            return pd.DataFrame(index=pd.PeriodIndex([], freq='M', name='month'))
+
+        df = pd.read_parquet(self.path(name))
+        df.index = df.index.to_period('M')
+        return df
+
+    def _write(self, name, df):
+        os.makedirs(self.root, exist_ok=True)
+        df = df.copy()
+        df.index = df.index.to_timestamp()
+        df.to_parquet(self.path(name))
+
+    def append(self, part, source, now=None):
+        """
+        Merge part (PeriodIndex frame from source) into the store cell by cell: a month & series
+        with no number stored yet is filled in, one whose number changed is overwritten. A blank in
+        part never erases what's stored. Returns the months where anything changed
+        """
+
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        values, provenance, stored = self._read('macro'), self._read('provenance'), self._read('stored')
+
+        index = values.index.union(part.index)
+        columns = values.columns.union(part.columns, sort=False)
+        values = values.reindex(index=index, columns=columns)
+        provenance = provenance.reindex(index=index, columns=columns).astype(object)
+        stored = stored.reindex(index=index, columns=columns)
+        incoming = part.reindex(index=index, columns=columns)
+
+        # NaN never equals anything, so this is both new cells & revised ones
+        changed = incoming.notna() & (incoming != values)
+        months = index[changed.to_numpy().any(axis=1)]
+        if months.empty:
+            return months
+
+        provenance = provenance.mask(changed, source)
+        self._write('macro', values.mask(changed, incoming))
+        self._write('provenance', provenance.where(provenance.notna(), None))
+        self._write('stored', stored.mask(changed, now).astype('datetime64[ns]'))
+
+        return months
+
+    def update(self, multpl=None, shiller=None):
+        """ Merge whatever's new from MultplLoader.load / ShillerLoader.load output; returns {source: months changed} """
+
+        added = {}
+        if multpl is not None:
+            added['multpl'] = self.append(multpl_monthly(multpl), 'multpl')
+        if shiller is not None:
+            added['shiller'] = self.append(shiller_monthly(shiller), 'shiller')
+
+        return added
+
+    def load(self, provenance=False):
+        """
+        The aligned frame, every month present. With provenance=True, (values, sources, stored): which
+        source each cell came from and when it was written, on the same index & columns
+        """
+
+        values = self._read('macro')
+        if values.empty:
+            raise ValueError('Macro store in ' + self.root + ' is empty; run update first')
+
+        values = _all_months(values)
+        if not provenance:
+            return values
+
+        return values, self._read('provenance').reindex(values.index), self._read('stored').reindex(values.index)
+
+
+def select_months(tbl, month, year=None):
+    """
+    Rows of a macro frame for a month or a range of months.
+    month, year as numbers (12, 2008); or a date in any form Period understands ('2008-12',
+    Timestamp, Period) with year left out; or a range as a slice/tuple ('2007-01', '2009-04')
+    """
+
+    if year is not None:
+        key = pd.Period(year=int(year), month=int(month), freq='M')
+    elif isinstance(month, (slice, tuple)):
+        start, stop = (month.start, month.stop) if isinstance(month, slice) else month
+        key = slice(pd.Period(start, freq='M') if start is not None else None,
+                    pd.Period(stop, freq='M') if stop is not None else None)
+    else:
+        key = pd.Period(month, freq='M')
+
+    rows = tbl.loc[key]
+    return rows.to_frame().T if isinstance(rows, pd.Series) else rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Save trimmed multpl.com pages as test fixtures')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'multpl'))
+    parser.add_argument('--since', default='2000-01-01', help='drop months before this date')
+    parser.add_argument('names', nargs='*', help='series from multpl_series; defaults to all of them')
+    args = parser.parse_args()
+
+    record_multpl_fixtures(args.out, args.since, args.names)
@@ -0,0 +1,150 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import yfinance as yf
+
+import http_transport as transport
+
+try:
+    from yfinance.exceptions import YFException
+except ImportError:
+    # yfinance before 0.2.40 has no exceptions module; it raises the requests/parsing errors below
+    YFException = ()
+
+# What a failed .info lookup raises: HTTP/connection trouble, yfinance's own errors, or a
+# response it couldn't parse. Anything else (incl. a MissingCassette on replay) is a real bug
+fetch_errors = (requests.RequestException, YFException, KeyError, ValueError, TypeError)
+
+# Quote lookups (trailingPE, marketCap, dividendYield, ...) go through a QuoteCache so that
+# every methodology / notebook cell asking about the same ticker shares one fetch.
+# Where the quotes come from is a QuoteProvider; swap in StaticQuoteProvider for tests.
+
+
+class QuoteProvider(object):
+
+    """ Interface for anything that can return quote/info dicts for a batch of tickers """
+
+    def get_quotes(self, tickers):
+        """ Return {ticker: info dict}; tickers that can't be fetched are left out """
+        raise NotImplementedError
+
+
+class YFinanceProvider(QuoteProvider):
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.warned = set()
+
+    def _info(self, tikrs, ticker):
+        try:
+            # Through the transport so quotes can be recorded & replayed like the HTTP calls
+            return transport.call('yfinance://info/' + ticker.upper(), lambda: tikrs.tickers[ticker.upper()].info)
+        except fetch_errors as e:
+            # Once per ticker; a watchlist refreshed every few minutes would otherwise repeat it forever
+            if ticker not in self.warned:
+                self.warned.add(ticker)
+                print("WARN: Couldn't fetch quote for " + ticker + ": " + str(e))
+            return None
+
+    def get_quotes(self, tickers):
+
+        # Yahoo has no batch endpoint for .info, so the best we can do is one yf.Tickers
+        # (shared session/cookies) and fan the per-symbol lookups out over a thread pool
+        tikrs = yf.Tickers(' '.join(tickers))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as ex:
+            infos = list(ex.map(lambda t: self._info(tikrs, t), tickers))
+
+        return {t: info for t, info in zip(tickers, infos) if info is not None}
+
+
+class StaticQuoteProvider(QuoteProvider):
+
+    """ Serves quotes from a dict; for tests and offline use. calls counts provider round trips """
+
+    def __init__(self, quotes):
+        self.quotes = quotes
+        self.calls = 0
+
+    def get_quotes(self, tickers):
+        self.calls += 1
+        return {t: self.quotes[t] for t in tickers if t in self.quotes}
+
+
+class QuoteCache(object):
+
+    def __init__(self, provider=None, ttl=15 * 60, clock=time.monotonic):
+        """
+        provider: QuoteProvider, defaults to yfinance
+        ttl: seconds a quote stays fresh
+        """
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.ttl = ttl
+        self.clock = clock
+        self._quotes = {}
+
+    def _is_fresh(self, ticker, now):
+        entry = self._quotes.get(ticker)
+        return entry is not None and now - entry[0] < self.ttl
+
+    def get_quotes(self, tickers):
+        """ Quotes for many tickers; everything missing or stale is fetched in one provider call """
+
+        now = self.clock()
+        stale = [t for t in dict.fromkeys(tickers) if not self._is_fresh(t, now)]
+
+        if stale:
+            for t, info in self.provider.get_quotes(stale).items():
+                self._quotes[t] = (now, info)
+
+        # A failed refresh falls back to the last quote we had
+        return {t: self._quotes[t][1] for t in tickers if t in self._quotes}
+
+    def get_quote(self, ticker):
+        quotes = self.get_quotes([ticker])
+        if ticker not in quotes:
+            raise KeyError('No quote available for ' + ticker)
+        return quotes[ticker]
+
+    def prefetch(self, tickers):
+        """ Warm the cache for a watchlist before running methodologies over it """
+        self.get_quotes(tickers)
+
+    def save_snapshot(self, path):
+        """ Write the cached quotes to a JSON file, e.g. to replay a notebook offline with load_snapshot """
+
+        with open(path, 'w') as f:
+            json.dump({t: info for t, (_, info) in self._quotes.items()}, f, default=str)
+
+    def invalidate(self, ticker=None):
+        if ticker is None:
+            self._quotes.clear()
+        else:
+            self._quotes.pop(ticker, None)
+
+
+def load_snapshot(path):
+    """
+    {ticker: info} saved by QuoteCache.save_snapshot.
+    QuoteCache(StaticQuoteProvider(load_snapshot(path))) replays it without the network
+    """
+
+    with open(path) as f:
+        return json.load(f)
+
+
+_quote_cache = None
+
+def get_quote_cache():
+    """ Shared cache used when callers don't pass their own """
+    global _quote_cache
+    if _quote_cache is None:
+        _quote_cache = QuoteCache()
+    return _quote_cache
+
+def set_quote_cache(cache):
+    """ Replace the shared cache, e.g. with QuoteCache(StaticQuoteProvider({...})) in tests """
+    global _quote_cache
+    _quote_cache = cache
@@ -7,74 +7,85 @@ import matplotlib.dates as mdates
 import requests
 import yfinance as yf
 
+import macro_data as macro
+import market_data as md
 
-def get_data_from_multpl_site():
-    # From: https://stackoverflow.com/questions/6325216/parse-html-table-to-python-list
-    
-    url = r'https://www.multpl.com/s-p-500-dividend-yield/table/by-month'
-    tables = pd.read_html(url) # Returns list of all tables on page
-    sp500_div_table = tables[0] # Select table of interest
 
-    sp500_div_table.Date = sp500_div_table['Date'].astype('datetime64[ns]')
-    sp500_div_table.rename(columns={'Yield Value': 'DivYield'}, inplace=True)
-    sp500_div_table.DivYield = sp500_div_table.DivYield.str.extract('(\d+.\d+)',expand=False).astype(float)/100.0
-    sp500_div_table.set_index(sp500_div_table['Date'].dt.month.astype(str)+'-'+sp500_div_table['Date'].dt.year.astype(str), inplace=True)
+def get_data_from_multpl_site(series=('PE', 'DivYield', 'TsyYield'), loader=None):
+    """
+    Monthly multpl.com series merged on month, indexed by 'M-YYYY' strings (e.g. '3-2000').
+    series: any names in macro_data.multpl_series, e.g. add 'CAPE_multpl' or 'EarningsYield'
+    loader: macro_data.MultplLoader; the default caches for a day under .cache/
+    """
 
-    sp500_div_table = sp500_div_table.tail(-1) # drop 1st row
+    loader = loader if loader is not None else macro.MultplLoader()
+    data = loader.load(series)
 
-    url = r'https://www.multpl.com/s-p-500-pe-ratio/table/by-month'
-    tables = pd.read_html(url) # Returns list of all tables on page
-    sp500_pe_table = tables[0] # Select table of interest
+    # MERGE RESULTS; only months every series has, newest first like the multpl tables
+    temp_df = pd.concat([data[name] for name in series], axis=1, join='inner').sort_index(ascending=False)
+    temp_df.index = macro.month_year_index(temp_df.index)
 
+    return temp_df
 
-    sp500_pe_table.Date = sp500_pe_table['Date'].astype('datetime64[ns]')
-    sp500_pe_table.rename(columns={'Value Value': 'PE'}, inplace=True)
-    sp500_pe_table.PE = sp500_pe_table.PE.str.extract('(\d+.\d+)', expand=False).astype(float)
-    sp500_pe_table.set_index(sp500_pe_table['Date'].dt.month.astype(str)+'-'+sp500_pe_table['Date'].dt.year.astype(str), inplace=True)
+def get_data_from_shiller(loader=None):
+    """
+    Shiller's ie_data sheet: DatetimeIndex 'date' (first of each month), float columns named as before
+    ('s&p comp price', ..., 'int rate GS10', ..., 'CAPE').
+    loader: macro_data.ShillerLoader; the default re-checks the workbook daily and keeps it under .cache/
+    """
 
-    sp500_pe_table = sp500_pe_table.tail(-1) # drop 1st row
+    loader = loader if loader is not None else macro.ShillerLoader()
+    return loader.load()
 
-    url = r'https://www.multpl.com/10-year-treasury-rate/table/by-month'
-    tables = pd.read_html(url) # Returns list of all tables on page
-    tsy_yield_table = tables[0] # Select table of interest
+def get_datasets():
+    return get_data_from_multpl_site(), get_data_from_shiller()
 
-    tsy_yield_table.Date = tsy_yield_table['Date'].astype('datetime64[ns]')
-    tsy_yield_table.rename(columns={'Value Value': 'TsyYield'}, inplace=True)
-    tsy_yield_table.TsyYield = tsy_yield_table.TsyYield.str.extract('(\d+.\d+)',expand=False).astype(float)/100.0
+def get_macro_dataset(series=('PE', 'DivYield', 'TsyYield', 'EarningsYield'), loader=None, shiller_df=None, store=None):
+    """
+    multpl & Shiller data in one frame indexed by monthly Period, oldest first.
+    Columns: the multpl series plus Price, Dividend, Earnings, CPI, GS10, RealPrice, RealDividend,
+    RealTotalReturnPrice, RealEarnings, CAPE (see macro_data.shiller_columns)
+    DivYield/TsyYield are fractions as before; GS10 is in percent as Shiller publishes it
+    e.g. tbl.loc['2008-12', 'PE'] or tbl.loc['2007-01':'2009-04']
+    store: macro_data.MacroStore; new months are appended to it and the frame comes from it.
+    Without fetching anything, macro_data.MacroStore().load() gives the last stored frame
+    """
 
-    tsy_yield_table.set_index(tsy_yield_table['Date'].dt.month.astype(str)+'-'+tsy_yield_table['Date'].dt.year.astype(str), inplace=True)
+    loader = loader if loader is not None else macro.MultplLoader()
+    shiller_df = shiller_df if shiller_df is not None else get_data_from_shiller()
 
-    tsy_yield_table = tsy_yield_table.tail(-1)
+    if store is None:
+        return macro.build_macro_frame(loader.load(series), shiller_df)
 
-    # MERGE RESULTS
-    temp_df = pd.merge(sp500_pe_table.iloc[:,1], sp500_div_table.iloc[:,1], left_index=True, right_index=True)
+    store.update(multpl=loader.load(series), shiller=shiller_df)
+    return store.load()
 
-    temp_df = pd.merge(temp_df, tsy_yield_table.iloc[:,1],left_index=True, right_index=True)
-    # return sp500_div_table, sp500_pe_table,tsy_yield_table
-    return temp_df
+def _rows_for(tbl, month, year):
+    """ The month (or range of months) asked for; string-indexed tables from get_datasets still work """
 
-def get_data_from_shiller():
+    if isinstance(tbl.index, pd.PeriodIndex):
+        return macro.select_months(tbl, month, year)
 
-    temp_df = pd.read_excel("http://www.econ.yale.edu/~shiller/data/ie_data.xls",sheet_name='Data',skiprows=8,usecols="A:M",names=['date','s&p comp price','s&p comp div','s&p comp earnings','CPI',
-                        'date fraction','int rate GS10','real price','real div','real total ret price', 'real earnings','real tr scaled earnings','CAPE'],header=None,skipfooter=1)
+    indx = str(month)+'-'+str(year)
+    return tbl.loc[[indx]]
 
-    temp_df['date']=temp_df['date'].astype(str)
-    temp_df.set_index('date', inplace=True)
-    return temp_df
+def calcJBWSP500(tbl, month, year=None):
+    """
+    With the frame from get_macro_dataset, month can also be a date ('2008-12') or a range
+    (('2007-01', '2009-04')) with year left out; you get one row per month
+    """
 
-def get_datasets():
-    return get_data_from_multpl_site(), get_data_from_shiller()
+    rows = _rows_for(tbl, month, year)
+    growth = rows["DivYield"]+.05
+    tsy_yield = rows["TsyYield"]
 
-def calcJBWSP500(tbl, month, year):
-    
-    indx = str(month)+'-'+str(year)
-    growth = tbl.loc[indx, "DivYield"]+.05
-    tsy_yield = tbl.loc[indx, "TsyYield"]
+    df = pd.DataFrame({"DivYield": rows["DivYield"],
+                       "Total Return": growth,
+                       "10-yr Tsy Rate": tsy_yield,
+                       "Tot Return - 10yr Tsy": growth - tsy_yield})
 
-    df = pd.DataFrame({"DivYield": [tbl.loc[indx, "DivYield"]],
-                       "Total Return": [growth],
-                       "10-yr Tsy Rate": [tsy_yield],
-                       "Tot Return - 10yr Tsy": [growth - tsy_yield]})
+    if not isinstance(tbl.index, pd.PeriodIndex):
+        df.reset_index(drop=True, inplace=True)
     
     # if growth > tsy_yield:
     #     s = f'Growth {growth:.4f} is larger than TsyYield of {tsy_yield:.4f}; Diff is {growth-tsy_yield:.4f}; May be OK to enter market!'
@@ -83,18 +94,23 @@ def calcJBWSP500(tbl, month, year):
 
     return df
 
-def calcBogle(tbl, month, year,future_pes=[10,15,20,25,30]):
+def calcBogle(tbl, month, year=None,future_pes=[10,15,20,25,30]):
+    """ month/year as in calcJBWSP500; for a range of months there's a block of scenarios per month """
 
     print(f"Assuming long-run growth of earnings of 5%")
-    indx = str(month) + '-' + str(year)
-    div_yield = tbl.loc[indx, "DivYield"]
-    tsy_yield = tbl.loc[indx, "TsyYield"]
-    pe = tbl.loc[indx, "PE"]
+    rows = _rows_for(tbl, month, year)
+    div_yield = np.repeat(rows["DivYield"].to_numpy(dtype=float), len(future_pes))
+    tsy_yield = np.repeat(rows["TsyYield"].to_numpy(dtype=float), len(future_pes))
+    pe = np.repeat(rows["PE"].to_numpy(dtype=float), len(future_pes))
 
-    scenarios_df = pd.DataFrame({'Earnings Growth %':[.05]*len(future_pes)})
-    scenarios_df['PE in 10 years'] = future_pes
+    scenarios_df = pd.DataFrame({'Earnings Growth %':[.05]*len(pe)})
+    scenarios_df['PE in 10 years'] = np.tile(future_pes, len(rows))
 
-    print(f'PE on {indx} is: {pe}')
+    if isinstance(tbl.index, pd.PeriodIndex):
+        scenarios_df.insert(0, 'Month', np.repeat(rows.index, len(future_pes)))
+
+    if len(rows) == 1:
+        print(f'PE on {rows.index[0]} is: {pe[0]}')
     scenarios_df['PE Growth'] = pow((scenarios_df['PE in 10 years']/pe),(1/10))-1
     scenarios_df['TotalReturn'] = div_yield + .05 + scenarios_df['PE Growth']
     scenarios_df['TsyYield'] = tsy_yield
@@ -102,39 +118,228 @@ def calcBogle(tbl, month, year,future_pes=[10,15,20,25,30]):
 
     return scenarios_df
 
-def calcShillerCAEP(tbl, month, year):
+def calcShillerCAEP(tbl, month, year=None):
+    """
+    tbl is either get_data_from_shiller() (month, year as numbers; older str-indexed copies work too)
+    or the get_macro_dataset frame, where month can also be a date or a range like calcJBWSP500
+    """
 
     print("Using 2.5% as long run inflation rate; may not apply now!")
 
-    indx = str(year)+'.'
-
-    "Sticking a leading 0 in front of month if needed"
-    mth = str(month)
-    if len(mth) < 2:
-        indx += '0'
-    indx += mth
-
-    cape = tbl.loc[indx, 'CAPE']
+    if isinstance(tbl.index, pd.PeriodIndex):
+        rows = macro.select_months(tbl, month, year)
+        cape = rows['CAPE']
+        tsy_rate = rows['GS10']
+    elif isinstance(tbl.index, pd.DatetimeIndex):
+        indx = pd.Timestamp(year=int(year), month=int(month), day=1)
+        cape = tbl.loc[[indx], 'CAPE']
+        tsy_rate = tbl.loc[[indx], 'int rate GS10']
+    else:
+        indx = str(year)+'.'
+
+        "Sticking a leading 0 in front of month if needed"
+        mth = str(month)
+        if len(mth) < 2:
+            indx += '0'
+        indx += mth
+
+        # The index is str() of Shiller's float dates, so October 2016 is '2016.1' not '2016.10'
+        if indx not in tbl.index and month == 10:
+            indx = str(year)+'.1'
+
+        cape = tbl.loc[[indx], 'CAPE']
+        tsy_rate = tbl.loc[[indx], 'int rate GS10']
+
+    cape = cape.astype(float)
     caep = (1/cape) * 100
-    tsy_rate = tbl.loc[indx, 'int rate GS10']
+    tsy_rate = tsy_rate.astype(float)
     real_tsy_rate = tsy_rate - 2.5
     total_ret = caep - real_tsy_rate
 
-    temp_df = pd.DataFrame({'CAPE': [cape],
-                            'CAEP': [caep],
-                            'TSY RATE': [tsy_rate],
-                            'REAL TSY RATE': [real_tsy_rate],
-                            'TOT RET': [total_ret]})
+    temp_df = pd.DataFrame({'CAPE': cape,
+                            'CAEP': caep,
+                            'TSY RATE': tsy_rate,
+                            'REAL TSY RATE': real_tsy_rate,
+                            'TOT RET': total_ret})
 
+    if not isinstance(tbl.index, pd.PeriodIndex):
+        temp_df.reset_index(drop=True, inplace=True)
 
     return temp_df
 
-def get_ticker(tkr):
-    tkr_data = yf.Ticker(tkr)
+# History versions of the three index calcs: every month of the get_macro_dataset frame (or
+# start..end) in one pass over the columns, instead of calling the calcs a month at a time.
+
+def _history_rows(tbl, start, end):
+    if not isinstance(tbl.index, pd.PeriodIndex):
+        raise ValueError('History calcs need the monthly frame from get_macro_dataset')
+
+    return macro.select_months(tbl, slice(start, end))
+
+def calcJBWSP500History(tbl, start=None, end=None, div_growth=.05):
+    """ calcJBWSP500 for every month from start to end (dates like '2007-01'; None = open ended) """
+
+    rows = _history_rows(tbl, start, end)
+    div_yield = rows['DivYield'].to_numpy(dtype=float)
+    tsy_yield = rows['TsyYield'].to_numpy(dtype=float)
+    growth = div_yield + div_growth
+
+    return pd.DataFrame({'DivYield': div_yield,
+                         'Total Return': growth,
+                         '10-yr Tsy Rate': tsy_yield,
+                         'Tot Return - 10yr Tsy': growth - tsy_yield}, index=rows.index)
+
+def calcBogleHistory(tbl, start=None, end=None, future_pes=[10,15,20,25,30], earnings_growth=.05):
+    """ calcBogle for every month from start to end; one row per (Month, PE in 10 years) """
+
+    rows = _history_rows(tbl, start, end)
+    future_pes = np.asarray(future_pes, dtype=float)
+
+    # months down, scenarios across
+    pe = rows['PE'].to_numpy(dtype=float)[:, None]
+    div_yield = rows['DivYield'].to_numpy(dtype=float)[:, None]
+    tsy_yield = rows['TsyYield'].to_numpy(dtype=float)[:, None]
+
+    pe_growth = pow(future_pes[None, :] / pe, 1/10) - 1
+    total_return = div_yield + earnings_growth + pe_growth
+    shape = pe_growth.shape
+
+    return pd.DataFrame({'Month': np.repeat(rows.index, len(future_pes)),
+                         'Earnings Growth %': earnings_growth,
+                         'PE in 10 years': np.broadcast_to(future_pes, shape).ravel(),
+                         'PE Growth': pe_growth.ravel(),
+                         'TotalReturn': total_return.ravel(),
+                         'TsyYield': np.broadcast_to(tsy_yield, shape).ravel(),
+                         'TotReturn - TsyYield': (total_return - tsy_yield).ravel()})
+
+def calcShillerCAEPHistory(tbl, start=None, end=None, inflation=2.5):
+    """ calcShillerCAEP for every month from start to end; rates in percent like Shiller's """
+
+    rows = _history_rows(tbl, start, end)
+    cape = rows['CAPE'].to_numpy(dtype=float)
+    tsy_rate = rows['GS10'].to_numpy(dtype=float)
+    caep = 100 / cape
+    real_tsy_rate = tsy_rate - inflation
+
+    return pd.DataFrame({'CAPE': cape,
+                         'CAEP': caep,
+                         'TSY RATE': tsy_rate,
+                         'REAL TSY RATE': real_tsy_rate,
+                         'TOT RET': caep - real_tsy_rate}, index=rows.index)
+
+# Monte Carlo version of calcBogle / calcBogleForStock.
+# Instead of a few hand-typed (growth, future P/E) scenarios, draw them: yearly earnings growth
+# for each of the years (compounded along the path), the P/E at the end and the dividend yield.
+# Any input can be a number (held fixed) or a draw function (rng, size) -> array, e.g. from
+# normal_draws / uniform_draws / bootstrap_draws, or the Shiller history via shiller_bootstrap.
+
+def normal_draws(mean, sd):
+    return lambda rng, size: rng.normal(mean, sd, size)
+
+def uniform_draws(low, high):
+    return lambda rng, size: rng.uniform(low, high, size)
+
+def bootstrap_draws(values):
+    """ Resample (with replacement) from observed values """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    return lambda rng, size: rng.choice(values, size)
+
+def shiller_bootstrap(shiller_df):
+    """
+    Draw functions for calcBogleMonteCarlo resampled from Shiller's monthly history (get_data_from_shiller):
+    yearly earnings growth (12-month changes), trailing P/E and dividend yield
+    """
+
+    price = shiller_df['s&p comp price'].astype(float)
+    earnings = shiller_df['s&p comp earnings'].astype(float)
+    div = shiller_df['s&p comp div'].astype(float)
+
+    return {'earnings_growth': bootstrap_draws(earnings.pct_change(12, fill_method=None)),
+            'future_pe': bootstrap_draws(price / earnings),
+            'div_yield': bootstrap_draws(div / price)}
+
+def _draw(spec, rng, size):
+    if callable(spec):
+        return spec(rng, size)
+    return np.full(size, float(spec))
+
+def calcBogleMonteCarlo(pe, tsy_yield, div_yield, earnings_growth=normal_draws(.05, .02),
+                        future_pe=uniform_draws(10, 30), years=10, num_paths=100000, seed=None,
+                        percentiles=[5, 25, 50, 75, 95], return_paths=False):
+    """
+    Bogle's total return (dividend yield + earnings growth + P/E change per year) over num_paths
+    simulated paths. pe, tsy_yield & div_yield are today's, e.g. from the macro frame or tikr.info.
+    Returns a Series of TotalReturn percentiles, the mean and the probability of beating tsy_yield;
+    with return_paths=True also a frame of the draws behind each path
+    """
+
+    rng = np.random.default_rng(seed)
+
+    growth = _draw(earnings_growth, rng, (num_paths, years))
+    # Compound the yearly draws along each path, then annualize
+    annual_growth = np.prod(1 + growth, axis=1) ** (1 / years) - 1
+
+    pe_end = _draw(future_pe, rng, num_paths)
+    pe_growth = pow(pe_end / pe, 1 / years) - 1
+    dy = _draw(div_yield, rng, num_paths)
 
-    return tkr_data
+    total_return = dy + annual_growth + pe_growth
+
+    summary = pd.Series(np.nanpercentile(total_return, percentiles), index=['p%g' % p for p in percentiles])
+    summary['mean'] = np.nanmean(total_return)
+    summary['P(beat TsyYield)'] = np.mean(total_return > tsy_yield)
+    summary.name = 'TotalReturn'
+
+    if not return_paths:
+        return summary
+
+    paths = pd.DataFrame({'Earnings Growth %': annual_growth,
+                          'PE in %d years' % years: pe_end,
+                          'PE Growth': pe_growth,
+                          'DivYield': dy,
+                          'TotalReturn': total_return})
+    return summary, paths
+
+class CachedTicker(object):
+
+    """
+    yf.Ticker stand-in whose .info comes from a market_data.QuoteCache, so the calcs below
+    (which read tikr.info several times) and notebook cells share one fetch per ttl.
+    Anything else (history, financials, ...) goes to a yf.Ticker created on first use
+    """
+
+    def __init__(self, ticker, quotes=None):
+        self.ticker = ticker
+        self.quotes = quotes if quotes is not None else md.get_quote_cache()
+        self._yf_ticker = None
+
+    @property
+    def info(self):
+        return self.quotes.get_quote(self.ticker)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._yf_ticker is None:
+            self._yf_ticker = yf.Ticker(self.ticker)
+        return getattr(self._yf_ticker, name)
+
+    def __repr__(self):
+        return 'CachedTicker(%s)' % self.ticker
+
+def get_ticker(tkr, quotes=None):
+    """ quotes: market_data.QuoteCache; defaults to the shared one """
+    return CachedTicker(tkr, quotes)
 # .history(start="2020-06-02", end="2020-06-07", interval="1m")
 
+def get_tickers(tkrs, quotes=None):
+    """ {ticker: CachedTicker} with every quote fetched up front in one batch """
+
+    quotes = quotes if quotes is not None else md.get_quote_cache()
+    quotes.prefetch(tkrs)
+    return {t: CachedTicker(t, quotes) for t in tkrs}
+
 def calcJBWforTikr(tikr, tsy_yield, div_growth = .05):
 
     try:
@@ -179,6 +384,111 @@ def calcIRRforTikr(tikr, rate1, num_years1, rate2):
     print(f"Returning result as %")
     return Solution * 100
 
+# Batch IRR
+# Rather than npf.irr's polynomial root solve one scenario at a time, solve for the discount factor
+# v = 1/(1+IRR) of every scenario at once with Newton steps, falling back to bisection whenever a
+# step leaves the bracket. NPV(v) = sum CF_t v^t rises with v when only the first cashflow is
+# negative, so there's exactly one root in the bracket.
+
+def _solve_discount(npv, shape, lo=1/11., hi=100., tol=1e-12, max_iter=100):
+    """
+    npv: v -> (NPV, dNPV/dv), both arrays of the given shape
+    Brackets IRRs from -99% (v=100) to 1000% (v=1/11); scenarios with no root there come back NaN
+    """
+
+    lo = np.full(shape, lo)
+    hi = np.full(shape, hi)
+
+    f_lo, f_hi = npv(lo)[0], npv(hi)[0]
+    solvable = (f_lo <= 0) & (f_hi >= 0)
+
+    v = np.clip(np.full(lo.shape, 1 / 1.1), lo, hi) # start at 10%
+    dx_old = hi - lo
+    for _ in range(max_iter):
+        f, df = npv(v)
+        lo = np.where(f < 0, v, lo)
+        hi = np.where(f < 0, hi, v)
+
+        # Newton unless it leaves the bracket or isn't at least halving the step (rtsafe)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = v - f / df
+        bisect = ~np.isfinite(step) | (step <= lo) | (step >= hi) | (np.abs(2 * f) > np.abs(dx_old * df))
+        new_v = np.where(bisect, (lo + hi) / 2, step)
+
+        dx_old = np.abs(new_v - v)
+        v = new_v
+        if (dx_old <= tol * v).all():
+            break
+
+    return np.where(solvable, 1 / v - 1, np.nan)
+
+def irr_batch(cashflows):
+    """
+    IRR of every row of a 2-D cashflow matrix (column t = year t, column 0 usually -price).
+    Same answer as npf.irr row by row; NaN where no IRR between -99% and 1000%
+    """
+
+    cf = np.atleast_2d(np.asarray(cashflows, dtype=float))
+    t = np.arange(cf.shape[1])
+
+    def npv(v):
+        powers = v[:, None] ** t
+        return (cf * powers).sum(axis=1), (cf[:, 1:] * t[1:] * powers[:, :-1]).sum(axis=1)
+
+    return _solve_discount(npv, len(cf))
+
+def _geometric_sums(q, n):
+    """ S = sum q^t and T = sum t q^t for t = 1..n, in closed form (q == 1 handled) """
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q_n = q ** n
+        S = np.where(np.isclose(q, 1, rtol=0, atol=1e-9), n, q * (1 - q_n) / (1 - q))
+        T = np.where(np.isclose(q, 1, rtol=0, atol=1e-6), n * (n + 1) / 2,
+                     q * (1 - (n + 1) * q_n + n * q_n * q) / (1 - q) ** 2)
+
+    return S, T
+
+def two_stage_irr(dividend, price, rate1, num_years1, rate2, horizon=100):
+    """
+    IRR of buying at price and collecting a dividend growing at rate1 for num_years1 years, then
+    rate2 until horizon: calcIRRforTikr's model. All arguments broadcast against each other, and
+    the NPV is a pair of geometric series, so no cashflow matrix is built
+    """
+
+    dividend, price, rate1, num_years1, rate2 = np.broadcast_arrays(*[np.asarray(a, dtype=float) for a in
+                                                                        (dividend, price, rate1, num_years1, rate2)])
+    later_years = horizon - num_years1
+
+    def npv(v):
+        q1, q2 = (1 + rate1) * v, (1 + rate2) * v
+        S1, T1 = _geometric_sums(q1, num_years1)
+        S2, T2 = _geometric_sums(q2, later_years)
+        q1_n = q1 ** num_years1
+
+        # years 1..n at rate1, then years n+1..horizon continuing from the year-n dividend at rate2
+        f = dividend * (S1 + q1_n * S2) - price
+        df = dividend * (T1 + q1_n * (num_years1 * S2 + T2)) / v
+        return f, df
+
+    return _solve_discount(npv, price.shape)
+
+def calcIRRGrid(tikr, rate1, num_years1, rate2, prices=None, horizon=100):
+    """
+    calcIRRforTikr over every combination of the rate1, num_years1, rate2 & prices lists
+    (prices defaults to the current price). Returns one row per scenario with IRR in %
+    """
+
+    dividend = tikr.info['dividendRate']
+    prices = prices if prices is not None else [tikr.info['currentPrice']]
+
+    grid = pd.MultiIndex.from_product([np.atleast_1d(rate1), np.atleast_1d(num_years1), np.atleast_1d(rate2),
+                                       np.atleast_1d(prices)],
+                                      names=['rate1', 'num_years1', 'rate2', 'price']).to_frame(index=False)
+
+    grid['IRR %'] = two_stage_irr(dividend, grid['price'].to_numpy(), grid['rate1'].to_numpy(),
+                                  grid['num_years1'].to_numpy(), grid['rate2'].to_numpy(), horizon) * 100
+    return grid
+
 def calcJBWFromShareholderYield(d_per_share, tips_yield, risk_premium=.04, g=.02):
     """ JBW Variation using Shareholder Yield:
     Add Dividends + Repurchases and calc V = D /(R-g)
@@ -188,6 +498,35 @@ def calcJBWFromShareholderYield(d_per_share, tips_yield, risk_premium=.04, g=.02
 
     return (d_per_share)/(tips_yield+risk_premium-g)
 
+def calcJBWSensitivity(d_per_share, tips_yield, risk_premium=[.03, .04, .05], g=[.01, .02, .03]):
+    """
+    calcJBWFromShareholderYield over every combination of tips_yield, risk_premium & g for many
+    tickers at once. d_per_share: {ticker: (dividends + buybacks) / share}, or a Series of the same.
+    Where R = tips_yield + risk_premium <= g the value is undefined and comes back NaN
+    Returns one row per (Ticker, tips_yield, risk_premium, g)
+    """
+
+    d_per_share = pd.Series(d_per_share, dtype=float)
+
+    # tickers x tips_yield x risk_premium x g
+    d = d_per_share.to_numpy()[:, None, None, None]
+    tips = np.atleast_1d(np.asarray(tips_yield, dtype=float))[None, :, None, None]
+    premium = np.atleast_1d(np.asarray(risk_premium, dtype=float))[None, None, :, None]
+    growth = np.atleast_1d(np.asarray(g, dtype=float))[None, None, None, :]
+
+    R = tips + premium
+    spread = R - growth
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.where(spread > 0, d / spread, np.nan)
+
+    index = pd.MultiIndex.from_product([d_per_share.index, tips.ravel(), premium.ravel(), growth.ravel()],
+                                       names=['Ticker', 'tips_yield', 'risk_premium', 'g'])
+    df = index.to_frame(index=False)
+    df['R'] = np.broadcast_to(R, value.shape).ravel()
+    df['Value'] = value.ravel()
+
+    return df
+
 def calcBogleForStock(tikr, tsy_yield, earnings_growth=[.05,.10,.05,.10], future_pes=[30,30,15,20]):
     """
     calcBogleForStock takes earnings growth projections and future pe's and calcs
@@ -219,5 +558,36 @@ def calcBogleForStock(tikr, tsy_yield, earnings_growth=[.05,.10,.05,.10], future
     return scenarios_df
     
 
+def calcBogleGrid(tikrs, tsy_yield, earnings_growth=[.05, .10], future_pes=[15, 20, 30], quotes=None):
+    """
+    calcBogleForStock for N tickers x M earnings growth rates x K future P/Es in one broadcast.
+    tikrs: ticker symbols (quotes are prefetched in one batch) or objects with .info
+    Returns one row per (ticker, growth, P/E) with Rank = place by TotalReturn within each scenario
+    """
+
+    if all(isinstance(t, str) for t in tikrs):
+        tikrs = list(get_tickers(tikrs, quotes).values())
+
+    names = [getattr(t, 'ticker', str(t)) for t in tikrs]
+    pe = np.array([t.info['trailingPE'] for t in tikrs], dtype=float)
+    div_yield = np.array([t.info.get('dividendYield') or 0 for t in tikrs], dtype=float)
+
+    # tickers x growth x P/E
+    growth = np.asarray(earnings_growth, dtype=float)[None, :, None]
+    future_pe = np.asarray(future_pes, dtype=float)[None, None, :]
+    pe_growth = pow(future_pe / pe[:, None, None], 1/10) - 1
+    total_return = div_yield[:, None, None] + growth + pe_growth
 
+    shape = total_return.shape
+    df = pd.DataFrame({'Ticker': np.repeat(names, shape[1] * shape[2]),
+                       'Earnings Growth %': np.broadcast_to(growth, shape).ravel(),
+                       'PE in 10 years': np.broadcast_to(future_pe, shape).ravel(),
+                       'PE Growth %': np.broadcast_to(pe_growth, shape).ravel(),
+                       'TotalReturn': total_return.ravel(),
+                       'TsyYield': tsy_yield,
+                       'TotReturn - TsyYield': (total_return - tsy_yield).ravel()})
+
+    df['Rank'] = df.groupby(['Earnings Growth %', 'PE in 10 years'])['TotalReturn'].rank(ascending=False, method='min')
+
+    return df
 
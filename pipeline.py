@@ -0,0 +1,114 @@
+import ctypes
+import gc
+import os
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+import pyarrow as pa
+
+import edgar_utils as eu
+
+# Bounded-memory run of the edgar_utils flow over a large universe.
+# Tickers go through in chunks; each ticker's statement, metrics and report frames are flushed to
+# the FactStore as soon as they're built and dropped, and memory is handed back after each chunk.
+# With an RSS budget the chunk size adapts: it shrinks when a chunk pushed RSS over budget and grows
+# while there's room.
+
+
+def current_rss():
+    """ Resident set size of this process in bytes """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No /proc (e.g. macOS): peak RSS is the best available; ru_maxrss is bytes there
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def release_memory():
+    gc.collect()
+
+    # glibc keeps freed heap around; hand it back so RSS reflects what's actually in use
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ChunkSizer(object):
+
+    def __init__(self, chunk_size, rss_budget_mb=None, min_size=1, max_size=500):
+        self.size = chunk_size
+        self.budget = rss_budget_mb * 1024 * 1024 if rss_budget_mb else None
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def next_size(self, rss):
+        """ Chunk size to use next, given the RSS measured after the last chunk was flushed """
+
+        if self.budget is None:
+            return self.size
+
+        if rss > self.budget:
+            self.size = max(self.min_size, self.size // 2)
+        elif rss < self.budget / 2:
+            self.size = min(self.max_size, self.size + max(1, self.size // 2))
+
+        return self.size
+
+
+def flush_ticker(store, ticker, common_df, methods):
+    """ Write everything analyze_ticker produced for ticker to the store """
+
+    bs, income, cfs = methods[0].bs, methods[0].income, methods[0].cfs
+
+    store.save_frame(ticker, 'bs', bs.df)
+    store.save_frame(ticker, 'income', income.df)
+    store.save_frame(ticker, 'cfs', cfs.df)
+    store.save_frame(ticker, 'common', common_df)
+
+    for m in methods:
+        store.save_frame(ticker, m.name + '-metrics', m.metrics)
+        store.save_frame(ticker, m.name + '-report', m.report)
+
+def run_universe(tickers, store, chunk_size=25, rss_budget_mb=None, fetch=True, ticker_options=None):
+    """
+    tickers: list of tickers
+    store: fact_store.FactStore; facts are read from it and results flushed to it
+    fetch: go to EDGAR for tickers whose facts aren't in the store yet (False = offline)
+    ticker_options: ticker -> kwargs for edgar_utils.analyze_ticker
+    Returns {'done': [...], 'failed': {ticker: reason}, 'chunks': [(size, rss_bytes), ...]}
+    """
+
+    ticker_options = ticker_options or {}
+    sizer = ChunkSizer(chunk_size, rss_budget_mb)
+    pending = list(tickers)
+    result = {'done': [], 'failed': {}, 'chunks': []}
+
+    while pending:
+        chunk, pending = pending[:sizer.size], pending[sizer.size:]
+
+        for t in chunk:
+            # Flushed straight away, so one bad write is one failed ticker rather than the end of the run
+            try:
+                facts = store.fetch_facts(t) if fetch else store.load_facts(t)
+                common_df, methods = eu.analyze_ticker(facts, t, **ticker_options.get(t, {}))
+                flush_ticker(store, t, common_df, methods)
+                result['done'].append(t)
+            except (ValueError, KeyError, OSError, pa.ArrowException) as e:
+                print("WARN: Skipping " + t + ": " + str(e))
+                result['failed'][t] = str(e)
+            facts = common_df = methods = None
+
+        release_memory()
+        rss = current_rss()
+        result['chunks'].append((len(chunk), rss))
+        sizer.next_size(rss)
+
+    return result
@@ -0,0 +1,251 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import xlsxwriter
+
+# Excel export that streams rows straight to disk.
+# xlsxwriter's constant_memory mode flushes each row as soon as the next one starts, so a
+# workbook never sits in memory; the catch is rows have to be written top to bottom, which
+# is how the report layout works anyway (metrics, a gap, then the report under it).
+
+
+def _header(df):
+    index_names = [n if n is not None else '' for n in df.index.names]
+    return index_names + [str(c) for c in df.columns]
+
+def _rows(df):
+    """
+    The frame as one object block with the index in front, NaN turned into blanks and
+    +/-inf into 'inf'/'-inf' text (what to_excel writes; xlsxwriter won't take inf as a number)
+    """
+
+    flat = df.reset_index()
+    block = flat.to_numpy(dtype=object)
+    block[pd.isna(block)] = None
+
+    floats = [i for i, dtype in enumerate(flat.dtypes) if dtype.kind == 'f']
+    if floats:
+        values = flat.iloc[:, floats].to_numpy(dtype=np.float64)
+        block[:, floats] = np.where(np.isposinf(values), 'inf', np.where(np.isneginf(values), '-inf', block[:, floats]))
+
+    return block
+
+def write_frame(worksheet, df, startrow=0, header_format=None):
+    """ Write df (with its index) at startrow; returns the row after the last one written """
+
+    worksheet.write_row(startrow, 0, _header(df), header_format)
+
+    # One write_row per row of a prebuilt block, rather than per-cell to_excel formatting
+    for i, row in enumerate(_rows(df), start=startrow + 1):
+        worksheet.write_row(i, 0, row)
+
+    return startrow + len(df) + 1
+
+def apply_styles(workbook, worksheet, df, startrow, spec):
+    """
+    Excel version of MetricsMethodology.pretty for df written at startrow.
+    spec is (attribs, nums, pct) like pretty_columns. Number formats and the red/green sign colouring
+    are conditional formats over the metrics block only (not the report under it), so no cell is
+    styled one at a time and constant_memory still works
+    """
+
+    if not len(df):
+        return
+
+    attribs, nums, pct = spec
+    first_col = len(df.index.names)
+    position = {c: first_col + i for i, c in enumerate(df.columns)}
+    first_row, last_row = startrow + 1, startrow + len(df)
+
+    num_fmt = workbook.add_format({'num_format': '#,##0'})
+    pct_fmt = workbook.add_format({'num_format': '0.00%'})
+    red = workbook.add_format({'font_color': 'red'})
+    green = workbook.add_format({'font_color': 'green'})
+
+    for cols, fmt in [(nums, num_fmt), (pct, pct_fmt)]:
+        for c in cols:
+            if c in position:
+                col = position[c]
+                worksheet.conditional_format(first_row, col, last_row, col,
+                                             {'type': 'formula', 'criteria': 'TRUE', 'format': fmt})
+
+    for c in attribs:
+        if c in position:
+            col = position[c]
+            worksheet.conditional_format(first_row, col, last_row, col,
+                                         {'type': 'cell', 'criteria': '<', 'value': 0, 'format': red})
+            worksheet.conditional_format(first_row, col, last_row, col,
+                                         {'type': 'cell', 'criteria': '>=', 'value': 0, 'format': green})
+
+def write_report_workbook(fname, common_df, frames, styles=None):
+    """
+    fname: xlsx path
+    common_df: output of create_common_metrics (or None to skip the Common sheet)
+    frames: list of (sheetname, metrics, report)
+    styles: optional {sheetname: (attribs, nums, pct)} applied to the metrics block
+    """
+
+    styles = styles or {}
+    workbook = xlsxwriter.Workbook(fname, {'constant_memory': True})
+    bold = workbook.add_format({'bold': True})
+
+    if common_df is not None:
+        write_frame(workbook.add_worksheet('Common'), common_df, header_format=bold)
+
+    for sheetname, metrics, report in frames:
+        write_methodology_sheet(workbook, sheetname, metrics, report, styles.get(sheetname), bold)
+
+    workbook.close()
+    return fname
+
+def write_methodology_sheet(workbook, sheetname, metrics, report, spec=None, header_format=None):
+    """ One methodology's sheet: metrics (styled per spec), a 3 row gap, then the report """
+
+    worksheet = workbook.add_worksheet(sheetname)
+    if spec is not None:
+        apply_styles(workbook, worksheet, metrics, 0, spec)
+
+    write_frame(worksheet, metrics, header_format=header_format)
+    write_frame(worksheet, report, startrow=len(metrics) + 4, header_format=header_format)
+
+    return worksheet
+
+def xlsx_workbook(writer):
+    """ The xlsxwriter Workbook behind writer (itself, or a pd.ExcelWriter's book); None for any other engine """
+
+    book = getattr(writer, 'book', writer)
+    return book if isinstance(book, xlsxwriter.Workbook) else None
+
+def methodology_frames(methods):
+    return [(m.name, m.metrics, m.report) for m in methods]
+
+def methodology_styles(methods):
+    return {m.name: m.pretty_columns for m in methods if m.pretty_columns is not None}
+
+def _write_ticker_workbook(args):
+    return write_report_workbook(*args)
+
+def write_universe_workbooks(reports, out_dir, max_workers=None):
+    """
+    One workbook per ticker, written by a pool of worker processes.
+    reports maps ticker -> (common_df, list of methodologies)
+    Returns {ticker: path}
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Only the frames cross the process boundary, not the statements behind them
+    jobs = [(os.path.join(out_dir, ticker + '.xlsx'), common_df, methodology_frames(methods), methodology_styles(methods))
+            for ticker, (common_df, methods) in reports.items()]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        paths = list(ex.map(_write_ticker_workbook, jobs))
+
+    return dict(zip(reports.keys(), paths))
+
+
+# Columnar exports
+# Everything goes out as one long table keyed by (ticker, fy, methodology, metric), with the
+# number in value and any commentary in text. A methodology's metric & report column of the
+# same name (e.g. Mizrahi ROE) share a row. The Common sheet is stored as methodology 'Common'.
+
+long_columns = ['ticker', 'fy', 'methodology', 'metric', 'value', 'text']
+long_keys = ['ticker', 'fy', 'methodology', 'metric']
+
+def _stack_frame(df, ticker, methodology):
+    """ Long (ticker, fy, methodology, metric, value, text) rows for one frame """
+
+    if not isinstance(df.index, pd.MultiIndex):
+        df = pd.concat({ticker: df}, names=['ticker'])
+    df = df.rename_axis(index=['ticker', 'fy'], columns='metric')
+
+    numeric = df.select_dtypes('number')
+    text = df.drop(columns=numeric.columns).astype(object)
+
+    parts = []
+    if numeric.shape[1]:
+        parts.append(numeric.stack(dropna=False).rename('value').reset_index())
+    if text.shape[1]:
+        text = text.astype(str).where(text.notna(), None)
+        parts.append(text.stack(dropna=False).rename('text').reset_index())
+
+    if not parts:
+        return pd.DataFrame(columns=long_columns)
+
+    out = parts[0]
+    for part in parts[1:]:
+        out = out.merge(part, on=['ticker', 'fy', 'metric'], how='outer')
+
+    out['methodology'] = methodology
+    return out
+
+def long_format(frames, common_df=None, ticker=None):
+    """
+    frames: list of (methodology, metrics, report) as from methodology_frames
+    Frames indexed by fy need ticker; frames indexed by (ticker, fy) carry their own
+    """
+
+    parts = []
+    if common_df is not None:
+        parts.append(_stack_frame(common_df, ticker, 'Common'))
+
+    for methodology, metrics, report in frames:
+        m = _stack_frame(metrics, ticker, methodology)
+        r = _stack_frame(report, ticker, methodology)
+        parts.append(m.merge(r, on=long_keys, how='outer', suffixes=('', '_report')))
+
+    df = pd.concat(parts, ignore_index=True)
+
+    for c in ['value_report', 'text_report']:
+        if c in df.columns:
+            base = c[:-len('_report')]
+            df[base] = df[base].combine_first(df[c])
+            df = df.drop(columns=c)
+
+    df = df.reindex(columns=long_columns)
+    df['value'] = pd.to_numeric(df['value'])
+    # Repeated labels as dictionary columns; much smaller on disk and still zero-copy to read
+    for c in ['ticker', 'methodology', 'metric']:
+        df[c] = df[c].astype('category')
+
+    return df
+
+def write_columnar(df, fname, fmt='parquet'):
+    """ fmt: 'parquet', 'feather' or 'arrow' (Arrow IPC file) """
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if fmt == 'parquet':
+        pq.write_table(table, fname)
+    elif fmt == 'feather':
+        # Uncompressed so readers can memory map the buffers instead of decompressing
+        feather.write_feather(table, fname, compression='uncompressed')
+    elif fmt == 'arrow':
+        with pa.OSFile(fname, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        raise ValueError("fmt should be 'parquet', 'feather' or 'arrow'")
+
+    return fname
+
+def read_columnar(fname, columns=None, as_table=False):
+    """
+    Load an export back. Feather/Arrow files are memory mapped, so as_table=True is zero-copy;
+    pass columns to only touch the ones you need
+    """
+
+    if fname.endswith('.parquet'):
+        table = pq.read_table(fname, columns=columns, memory_map=True)
+    else:
+        source = pa.memory_map(fname, 'r')
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+
+    return table if as_table else table.to_pandas()
@@ -0,0 +1,217 @@
+import os
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+import http_transport as transport
+
+# Historical valuation (P/E, P/FCF, EV/EBIT, shareholder yield) per fiscal year or per quarter.
+# Fundamentals come from the EDGAR companyfacts frame (get_json_financials_from_tikr), prices
+# from a local PriceHistoryStore, and the two are lined up with an as-of join on the date the
+# numbers were first filed, i.e. the valuation the market put on the company once it knew them.
+
+# EDGAR tag -> column name; where several tags map to one name, earlier ones win
+flow_tags = {'EarningsPerShareDiluted': 'EPS',
+             'NetIncomeLoss': 'NetIncome',
+             'OperatingIncomeLoss': 'EBIT',
+             'NetCashProvidedByUsedInOperatingActivities': 'OCF',
+             'PaymentsToAcquirePropertyPlantAndEquipment': 'CapEx',
+             'PaymentsToAcquireProductiveAssets': 'CapEx',
+             'PaymentsForRepurchaseOfCommonStock': 'Buybacks',
+             'PaymentsOfDividends': 'Dividends',
+             'PaymentsOfDividendsCommonStock': 'Dividends',
+             'WeightedAverageNumberOfDilutedSharesOutstanding': 'Shares'}
+
+instant_tags = {'LongTermDebtNoncurrent': 'LongTermDebt',
+                'LongTermDebtCurrent': 'CurrentDebt',
+                'CashAndCashEquivalentsAtCarryingValue': 'Cash'}
+
+# Columns that add up over quarters; Shares is an average so it doesn't
+summable = ['EPS', 'NetIncome', 'EBIT', 'OCF', 'CapEx', 'Buybacks', 'Dividends']
+
+
+class PriceHistoryStore(object):
+
+    """ One parquet file of daily closes per ticker under root """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, ticker):
+        return os.path.join(self.root, ticker + '.parquet')
+
+    def save(self, ticker, prices):
+        """ prices: DataFrame with a 'date' column (or DatetimeIndex) and a 'close' column """
+
+        if 'date' not in prices.columns:
+            prices = prices.rename_axis('date').reset_index()
+
+        prices = prices[['date', 'close']].drop_duplicates('date', keep='last').sort_values('date')
+        prices.to_parquet(self.path(ticker), index=False)
+
+    def load(self, tickers):
+        """ Long frame of (ticker, date, close) for every ticker that has a history on disk """
+
+        frames = {t: pd.read_parquet(self.path(t)) for t in tickers if os.path.exists(self.path(t))}
+        if not frames:
+            return pd.DataFrame(columns=['ticker', 'date', 'close'])
+
+        return pd.concat(frames, names=['ticker']).reset_index(level=0).reset_index(drop=True)
+
+    def update_from_yfinance(self, ticker, start='2005-01-01'):
+        """ Fetch daily history and store closes as they traded (i.e. not split-adjusted) """
+
+        def fetch():
+            hist = yf.Ticker(ticker).history(start=start, auto_adjust=False)
+            return {'date': [str(d) for d in hist.index.tz_localize(None).normalize()],
+                    'close': hist['Close'].tolist(),
+                    'splits': hist['Stock Splits'].tolist()}
+
+        hist = transport.call('yfinance://history/%s?start=%s' % (ticker, start), fetch)
+
+        # yfinance closes are split-adjusted but EDGAR EPS & share counts are as reported,
+        # so multiply each close back up by every split that happened after it
+        splits = np.asarray(hist['splits'], dtype=float)
+        splits[splits == 0] = 1
+        later_splits = np.append(np.cumprod(splits[::-1])[::-1][1:], 1.0)
+
+        prices = pd.DataFrame({'date': pd.to_datetime(hist['date']),
+                               'close': np.asarray(hist['close'], dtype=float) * later_splits})
+
+        if os.path.exists(self.path(ticker)):
+            prices = pd.concat([pd.read_parquet(self.path(ticker)), prices])
+
+        self.save(ticker, prices)
+
+
+def stack_facts(facts_by_ticker):
+    """ Combine per-ticker companyfacts frames into one frame with a ticker column """
+    return pd.concat(facts_by_ticker, names=['ticker']).reset_index(level=0).reset_index(drop=True)
+
+def _with_first_filed(facts):
+    # Values are repeated as comparatives in later filings, and the fact SEC tags with a
+    # frame is often the latest of those. What the market knew when is the first filing.
+    first_filed = facts.groupby(['ticker', 'tag', 'start', 'end'], dropna=False)['filed'].transform('min')
+    return facts.assign(first_filed=first_filed)
+
+def _pick(facts, tags):
+    """ Rows for tags, renamed via tags dict, preferring the earlier tag when several map to a name """
+
+    df = facts[facts.tag.isin(tags.keys())]
+    df = df.assign(name=df.tag.map(tags),
+                   priority=df.tag.map({t: i for i, t in enumerate(tags)}))
+    return df.sort_values('priority')
+
+def _flows(facts):
+    df = _pick(facts[facts.frame.notna()], flow_tags)
+    df = df[df.frame.str.match(r'CY\d{4}(Q[1-4])?$')]
+    df = df.drop_duplicates(['ticker', 'frame', 'name'])
+
+    wide = df.pivot(index=['ticker', 'frame'], columns='name', values='val')
+    meta = df.groupby(['ticker', 'frame']).agg(end=('end', 'max'), filed=('first_filed', 'max'))
+    wide = wide.join(meta).reset_index()
+
+    for c in set(flow_tags.values()) - set(wide.columns):
+        wide[c] = np.nan
+
+    wide['year'] = wide.frame.str[2:6].astype(int)
+    wide['quarter'] = pd.to_numeric(wide.frame.str[7:8], errors='coerce')
+
+    return wide
+
+def _annual(flows):
+    annual = flows[flows.quarter.isna()].drop(columns=['frame', 'quarter'])
+    return annual.rename(columns={'year': 'period'})
+
+def _quarterly_ttm(flows):
+    """ Trailing-twelve-month flows at every quarter end """
+
+    quarters = flows[flows.quarter.notna()].set_index(['ticker', 'year', 'quarter'])
+    annual = flows[flows.quarter.isna()].set_index(['ticker', 'year'])
+
+    # 10-Ks don't report Q4 on its own; it's the year less the three 10-Q quarters
+    q123 = quarters[quarters.index.get_level_values('quarter') < 4]
+    q123 = q123[summable].groupby(['ticker', 'year']).sum(min_count=3)
+    q4 = annual[summable] - q123.reindex(annual.index)
+    q4['Shares'] = annual['Shares']
+    q4[['end', 'filed']] = annual[['end', 'filed']]
+    q4 = q4.assign(quarter=4.0).set_index('quarter', append=True)
+
+    quarters = quarters.drop(columns='frame').combine_first(q4)
+
+    # Lay every ticker out on one complete quarterly calendar so a 4-quarter rolling sum
+    # runs for the whole universe at once and a missing quarter gives NaN, not a stale TTM
+    idx = quarters.index
+    labels = idx.get_level_values('year').astype(str) + 'Q' + idx.get_level_values('quarter').astype(int).astype(str)
+    periods = pd.PeriodIndex(labels, freq='Q')
+    quarters.index = pd.MultiIndex.from_arrays([periods, idx.get_level_values('ticker')], names=['period', 'ticker'])
+
+    wide = quarters.unstack('ticker')
+    wide = wide.reindex(pd.period_range(wide.index.min(), wide.index.max(), freq='Q', name='period'))
+
+    ttm = wide[summable].rolling(4, min_periods=4).sum()
+    ttm = pd.concat([ttm, wide[['Shares', 'end', 'filed']]], axis=1)
+
+    ttm = ttm.stack('ticker').reset_index()
+    ttm['end'] = pd.to_datetime(ttm['end'])
+    ttm['filed'] = pd.to_datetime(ttm['filed'])
+
+    return ttm.dropna(subset=['filed'])
+
+def _instants(facts):
+    df = _pick(facts[facts.start.isna()], instant_tags)
+    df = df.drop_duplicates(['ticker', 'end', 'name'])
+    return df.pivot(index=['ticker', 'end'], columns='name', values='val')
+
+def fundamentals_panel(facts, freq='FY'):
+    """
+    One row per (ticker, period) with the flows and balance sheet items valuation needs.
+    freq='FY' gives calendar-year frames; freq='Q' gives trailing-twelve-month flows at each quarter
+    """
+
+    facts = _with_first_filed(facts)
+    flows = _flows(facts)
+
+    if freq == 'FY':
+        panel = _annual(flows)
+    elif freq == 'Q':
+        panel = _quarterly_ttm(flows)
+    else:
+        raise ValueError("freq should be 'FY' or 'Q'")
+
+    instants = _instants(facts).reindex(columns=list(instant_tags.values()))
+    panel = panel.join(instants, on=['ticker', 'end'])
+
+    return panel.reset_index(drop=True)
+
+def valuation_series(facts, prices, freq='FY'):
+    """
+    P/E, P/FCF, EV/EBIT & shareholder yield for every ticker and period in one pass.
+    facts: companyfacts frame with a ticker column (see stack_facts)
+    prices: (ticker, date, close) frame, e.g. PriceHistoryStore.load
+    Prices should be as traded, not split-adjusted, to line up with reported EPS & share counts
+    """
+
+    # merge_asof can't take null keys; a period with no filing date has no price to line up with anyway
+    panel = fundamentals_panel(facts, freq)
+    panel = panel[panel['filed'].notna()].sort_values('filed')
+    prices = prices.assign(date=pd.to_datetime(prices['date'])).dropna(subset=['date']).sort_values('date')
+
+    # Last close on or before the filing date, per ticker
+    df = pd.merge_asof(panel, prices.rename(columns={'date': 'price_date', 'close': 'price'}),
+                       left_on='filed', right_on='price_date', by='ticker', direction='backward')
+
+    debt = df['LongTermDebt'].fillna(0) + df['CurrentDebt'].fillna(0)
+
+    df['MarketCap'] = df['price'] * df['Shares']
+    df['FCF'] = df['OCF'] - df['CapEx']
+    df['EV'] = df['MarketCap'] + debt - df['Cash'].fillna(0)
+
+    df['P/E'] = df['price'] / df['EPS']
+    df['P/FCF'] = df['MarketCap'] / df['FCF']
+    df['EV/EBIT'] = df['EV'] / df['EBIT']
+    df['ShareholderYield'] = (df['Dividends'].fillna(0) + df['Buybacks'].fillna(0)) / df['MarketCap']
+
+    return df.sort_values(['ticker', 'period']).reset_index(drop=True)